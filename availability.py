@@ -0,0 +1,74 @@
+import numpy as np
+
+def mask_flags(mask: int, bit_count: int) -> np.ndarray:
+    packed = np.frombuffer(mask.to_bytes((bit_count + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder="little")[:bit_count].astype(bool)
+
+def mask_bits(mask: int, bit_count: int) -> np.ndarray:
+    return np.flatnonzero(mask_flags(mask, bit_count))
+
+def flags_mask(flags: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(flags, bitorder="little").tobytes(), "little")
+
+class SlotLayout:
+    def __init__(self, day_count: int, slot_count: int, parity_rank: int):
+        self.day_count = day_count
+        self.slot_count = slot_count
+        self.parity_rank = parity_rank
+        self.day_per_week = day_count // parity_rank
+
+#       Precomputed once so that no cell lookup has to divide
+        self.week_of_day = [day_i // self.day_per_week for day_i in range(day_count)]
+        self.first_bit_of_day = [(day_i - self.week_of_day[day_i] * self.day_per_week) * slot_count for day_i in range(day_count)]
+        self.week_count = self.week_of_day[-1] + 1 if day_count else 0
+        self.week_bit_count = self.day_per_week * slot_count
+        self.full_week_mask = (1 << self.week_bit_count) - 1
+
+    def locate(self, day_i: int, slot_i: int) -> tuple:
+        return (self.week_of_day[day_i], self.first_bit_of_day[day_i] + slot_i)
+
+    def cell_of(self, week: int, bit: int) -> tuple:
+        return (week * self.day_per_week + bit // self.slot_count, bit % self.slot_count)
+
+    def iter_cells(self, week: int, mask: int):
+        first_day = week * self.day_per_week
+        slot_count = self.slot_count
+        while mask:
+            lowest_bit = mask & -mask
+            bit = lowest_bit.bit_length() - 1
+            mask ^= lowest_bit
+            yield (first_day + bit // slot_count, bit % slot_count)
+
+    def iter_ranked_cells(self, week: int, ranked_bits: np.ndarray):
+        first_day = week * self.day_per_week
+        slot_count = self.slot_count
+        for bit in ranked_bits.tolist():
+            yield (first_day + bit // slot_count, bit % slot_count)
+
+class AvailabilityMask:
+    __slots__ = ("layout", "week_masks")
+
+    def __init__(self, layout: SlotLayout, free_flags: np.ndarray = None):
+        self.layout = layout
+
+        if free_flags is None:
+            free_flags = np.ones((layout.day_count, layout.slot_count), dtype=bool)
+        self.week_masks = [
+            flags_mask(free_flags[week * layout.day_per_week:(week + 1) * layout.day_per_week].reshape(-1))
+            for week in range(layout.week_count)
+        ]
+
+    def is_free(self, day_i: int, slot_i: int) -> bool:
+        week, bit = self.layout.locate(day_i, slot_i)
+        return (self.week_masks[week] >> bit) & 1 == 1
+
+    def occupy(self, day_i: int, slot_i: int):
+        week, bit = self.layout.locate(day_i, slot_i)
+        self.week_masks[week] &= ~(1 << bit)
+
+    def release(self, day_i: int, slot_i: int):
+        week, bit = self.layout.locate(day_i, slot_i)
+        self.week_masks[week] |= 1 << bit
+
+    def week_mask(self, week: int) -> int:
+        return self.week_masks[week]
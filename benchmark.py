@@ -0,0 +1,151 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from entity_system import Space
+from schedule_runner import make_schedule_model, build_schedule
+from instance_generator import INSTANCE_SIZES, load_instance, load_bundled_instance
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+BENCHMARK_MODES = {
+    "stepwise": {"engine": "negotiation", "fused_negotiation": False},
+    "fused": {"engine": "negotiation", "fused_negotiation": True},
+#   Bounded by nodes rather than time, so its counters stay deterministic and large doesn't run to the 10 s limit
+    "exact": {"engine": "exact", "exact": {"node_limit": 2000}}
+}
+#   Counted quantities are deterministic, peak memory gets a tolerance. Wall times swing a lot between
+#   identical runs and machines, so they warn past the tolerance and only fail past a much wider one
+COUNTED_METRICS = ("iterations", "messages")
+MEASURED_METRICS = ("peak_memory",)
+TIMED_METRICS = ("wall_time",)
+
+def run_once(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict) -> dict:
+    start_time = time.perf_counter()
+    schedule_model = make_schedule_model(main_config, group_config, room_config, timepref_config, Space())
+    iterations = build_schedule(schedule_model, verbose=False)
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        "iterations": iterations,
+        "wall_time": wall_time,
+        "messages": schedule_model.get_message_stats()["routed"],
+        "owned": schedule_model.owned_class_count(),
+        "completed": schedule_model.completed_count(),
+        "failed": schedule_model.failed_count()
+    }
+
+def measure_peak_memory(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict) -> int:
+#   Run apart from the timed runs, tracemalloc slows every allocation down
+    tracemalloc.start()
+    try:
+        run_once(main_config, group_config, room_config, timepref_config)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_mode(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict, mode_name: str, repeats: int, solver_config: dict = None) -> dict:
+    mode_config = copy.deepcopy(main_config)
+    mode_config["solver"] = copy.deepcopy(solver_config if solver_config is not None else main_config.get("solver", {}))
+    mode_config["solver"].update(BENCHMARK_MODES[mode_name])
+
+    results = [run_once(mode_config, group_config, room_config, timepref_config) for _ in range(repeats)]
+    best_result = min(results, key=lambda result: result["wall_time"])
+    best_result["peak_memory"] = measure_peak_memory(mode_config, group_config, room_config, timepref_config)
+    best_result["completion_rate"] = best_result["completed"] / best_result["owned"] if best_result["owned"] else 1.0
+    return best_result
+
+def run_suite(instance_names: list, mode_names: list, repeats: int) -> dict:
+    bundled_config = load_bundled_instance()[0]
+    results = {}
+    for instance_name in instance_names:
+        main_config, group_config, room_config, timepref_config = load_instance(instance_name)
+#       Generated instances run with the solver and trace settings of the bundled config
+        main_config.setdefault("trace", bundled_config.get("trace", {}))
+        for mode_name in mode_names:
+            result = run_mode(main_config, group_config, room_config, timepref_config, mode_name, repeats, bundled_config.get("solver", {}))
+            results[f"{instance_name}/{mode_name}"] = result
+            print_result(f"{instance_name}/{mode_name}", result)
+
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeats": repeats,
+        "results": results
+    }
+
+def _growth(run_name: str, metric: str, before: float, after: float) -> str:
+    return f"{run_name}: {metric} {before:.6g} -> {after:.6g} (+{(after / before - 1.0) * 100:.1f}%)"
+
+def compare_with_baseline(suite: dict, baseline: dict, tolerance: float, time_fail_tolerance: float) -> tuple:
+    regressions = []
+    warnings = []
+    for run_name, result in suite["results"].items():
+        baseline_result = baseline["results"].get(run_name)
+        if baseline_result is None: continue
+
+        if result["owned"] != baseline_result["owned"]:
+            regressions.append(f"{run_name}: instance changed, {baseline_result['owned']} -> {result['owned']} classes")
+            continue
+
+        for metric in COUNTED_METRICS:
+            if result[metric] > baseline_result[metric]:
+                regressions.append(f"{run_name}: {metric} {baseline_result[metric]} -> {result[metric]}")
+        if result["completed"] < baseline_result["completed"]:
+            regressions.append(f"{run_name}: completion dropped {baseline_result['completed']} -> {result['completed']}")
+        for metric in MEASURED_METRICS:
+            if result[metric] > baseline_result[metric] * (1.0 + tolerance):
+                regressions.append(_growth(run_name, metric, baseline_result[metric], result[metric]))
+        for metric in TIMED_METRICS:
+            if result[metric] > baseline_result[metric] * (1.0 + time_fail_tolerance):
+                regressions.append(_growth(run_name, metric, baseline_result[metric], result[metric]))
+            elif result[metric] > baseline_result[metric] * (1.0 + tolerance):
+                warnings.append(_growth(run_name, metric, baseline_result[metric], result[metric]))
+    return regressions, warnings
+
+def print_result(run_name: str, result: dict):
+    print(f"{run_name:<18} iterations: {result['iterations']:>6}  "
+          f"time: {result['wall_time'] * 1000:>9.2f} ms  "
+          f"messages: {result['messages']:>7}  "
+          f"memory: {result['peak_memory'] / 1024:>9.1f} KiB  "
+          f"completed: {result['completion_rate'] * 100:.2f}% ({result['completed']}/{result['owned']})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the solver on bundled and generated instances")
+    parser.add_argument("--instances", nargs="+", default=["bundled", *INSTANCE_SIZES], choices=["bundled", *INSTANCE_SIZES])
+    parser.add_argument("--modes", nargs="+", default=list(BENCHMARK_MODES), choices=list(BENCHMARK_MODES))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="benchmark_results.json", help="where the results are written")
+    parser.add_argument("--baseline", default=baseline_path, help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth of memory, and of time before it warns")
+    parser.add_argument("--time-fail-tolerance", type=float, default=2.0,
+                        help="relative growth of time that counts as a regression, wide since timings depend on the machine")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results over the baseline file")
+    args = parser.parse_args()
+
+    suite = run_suite(args.instances, args.modes, args.repeats)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(suite, output_file, indent=4)
+
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as baseline_file:
+            json.dump(suite, baseline_file, indent=4)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        regressions, warnings = compare_with_baseline(suite, json.load(baseline_file), args.tolerance, args.time_fail_tolerance)
+    for warning in warnings:
+        print(f"SLOWER {warning}")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+if __name__ == "__main__":
+    main()
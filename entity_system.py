@@ -1,37 +1,94 @@
 from abc import abstractmethod
+from enum import IntEnum
 
-class Space:
-    def _exists(self, data):
-        for index, entity_data in enumerate(self.entities):
-            if entity_data == data: return index
-        return False
+# Every kind owns the id range [kind * KIND_ID_STRIDE, (kind + 1) * KIND_ID_STRIDE),
+# so the kind of an id is a single division and a kind check is a range test.
+KIND_ID_STRIDE = 1 << 20
 
-    def __init__(self):
+class EntityKind(IntEnum):
+    SERVICE =       0
+    GROUP =         1
+    TEACHER =       2
+    CLASS =         3
+    CLASS_TYPE =    4
+    TOOL =          5
+    ROOM =          6
+
+class EntityTable:
+    def __init__(self, kind: EntityKind):
+        self.kind = kind
+        self.first_id = kind * KIND_ID_STRIDE
         self.entities = []
-    
+        self.entity_ids = {}
+
     def match(self, entity_data) -> int:
-        possible_index = self._exists(entity_data)
+        entity_id = self.entity_ids.get(entity_data)
+
+        if entity_id is None:
+            if len(self.entities) >= KIND_ID_STRIDE:
+                raise Exception(f"Entity table {self.kind.name} is full!")
 
-        if possible_index == False:
+            entity_id = self.first_id + len(self.entities)
             self.entities.append(entity_data)
-            return len(self.entities) - 1
-        else:
-            return possible_index
-    
-    def last_created_id(self) -> int:
-        entity_count = len(self.entities)
-        if entity_count == 0: return None
-        else: return entity_count - 1
-    
+            self.entity_ids[entity_data] = entity_id
+        return entity_id
+
+    def find(self, entity_data) -> int:
+        return self.entity_ids.get(entity_data)
+
+    def contains(self, entity_id) -> bool:
+        return self.first_id <= entity_id < self.first_id + len(self.entities)
+
     def get(self, entity_id: int):
-        return self.entities[entity_id]
-    
-    def get_entities(self):
+        return self.entities[entity_id - self.first_id]
+
+    def get_entities(self) -> list:
         return self.entities
 
+    def __len__(self) -> int:
+        return len(self.entities)
+
+class Space:
+    def __init__(self):
+        self.tables = [EntityTable(kind) for kind in EntityKind]
+
+    def table(self, kind: EntityKind) -> EntityTable:
+        return self.tables[kind]
+
+    def match(self, entity_data, kind: EntityKind) -> int:
+        return self.tables[kind].match(entity_data)
+
+    def find(self, entity_data, kind: EntityKind) -> int:
+        return self.tables[kind].find(entity_data)
+
+    def match_many(self, entity_data_list, kind: EntityKind) -> list:
+        table = self.tables[kind]
+        return [table.match(entity_data) for entity_data in entity_data_list]
+
+    def kind_of(self, entity_id: int) -> EntityKind:
+        if entity_id is None or entity_id < 0: return None
+
+        kind_index = entity_id // KIND_ID_STRIDE
+        if kind_index >= len(self.tables) or not self.tables[kind_index].contains(entity_id):
+            return None
+        return self.tables[kind_index].kind
+
+    def is_kind(self, entity_id: int, kind: EntityKind) -> bool:
+        return self.tables[kind].contains(entity_id)
+
+    def get(self, entity_id: int):
+        return self.tables[entity_id // KIND_ID_STRIDE].get(entity_id)
+
+    def get_entities(self) -> list:
+        entities = []
+        for table in self.tables:
+            for local_id, entity_data in enumerate(table.get_entities()):
+                entities.append((table.first_id + local_id, table.kind, entity_data))
+        return entities
+
 class IdDecoder:
     def __init__(self, space: Space):
         self.space = space
-    
+
     @abstractmethod
     def decode(self, custom_data): pass
\ No newline at end of file
@@ -0,0 +1,85 @@
+from collections import deque
+from enum import IntEnum
+
+class TraceLevel(IntEnum):
+    DEBUG =     10
+    INFO =      20
+    WARNING =   30
+    ERROR =     40
+    OFF =       100
+
+class TraceEvent:
+    __slots__ = ("step", "level", "text", "args")
+
+    def __init__(self, step: int, level: TraceLevel, text: str, args: tuple):
+        self.step = step
+        self.level = level
+        self.text = text
+        self.args = args
+
+    def format(self) -> str:
+        text = self.text.format(*self.args) if self.args else self.text
+        return f"[{self.step}] {self.level.name}: {text}"
+
+    def __str__(self) -> str:
+        return self.format()
+
+class EventTrace:
+    def __init__(self, level = TraceLevel.INFO, capacity: int = 10000, sample_every: int = 1):
+        if isinstance(level, str):
+            level = TraceLevel[level.upper()]
+        if capacity <= 0:
+            raise Exception(f"Trace capacity must be positive. Got {capacity}")
+        if sample_every <= 0:
+            raise Exception(f"Trace sampling period must be positive. Got {sample_every}")
+
+        self.events = deque(maxlen=capacity)
+        self.sample_every = sample_every
+        self.sample_counter = 0
+        self.recorded_count = 0
+        self.step = 0
+        self.set_level(level)
+
+    def set_level(self, level: TraceLevel):
+        self.level = level
+#       Hot paths test these flags before building any arguments
+        self.debug_enabled = level <= TraceLevel.DEBUG
+        self.info_enabled = level <= TraceLevel.INFO
+
+    def enabled_for(self, level: TraceLevel) -> bool:
+        return level >= self.level
+
+    def log(self, level: TraceLevel, text: str, *args):
+        if level < self.level: return
+
+#       Sampling only thins out routine events, warnings and errors are always kept
+        if self.sample_every > 1 and level < TraceLevel.WARNING:
+            self.sample_counter += 1
+            if self.sample_counter % self.sample_every: return
+
+        self.events.append(TraceEvent(self.step, level, text, args))
+        self.recorded_count += 1
+
+    def debug(self, text: str, *args):
+        self.log(TraceLevel.DEBUG, text, *args)
+
+    def info(self, text: str, *args):
+        self.log(TraceLevel.INFO, text, *args)
+
+    def warning(self, text: str, *args):
+        self.log(TraceLevel.WARNING, text, *args)
+
+    def error(self, text: str, *args):
+        self.log(TraceLevel.ERROR, text, *args)
+
+    def get_events(self, min_level: TraceLevel = TraceLevel.DEBUG) -> list:
+        return [event for event in self.events if event.level >= min_level]
+
+    def get_lines(self, min_level: TraceLevel = TraceLevel.DEBUG) -> list:
+        return [event.format() for event in self.events if event.level >= min_level]
+
+    def dropped_count(self) -> int:
+        return self.recorded_count - len(self.events)
+
+    def clear(self):
+        self.events.clear()
@@ -0,0 +1,245 @@
+import sys
+import time
+from solver_engine import SolverEngine, NegotiationEngine, StopReason
+from schedudle_model import SolutionType
+
+class ExactVariable:
+    __slots__ = ("teacher_agent", "class_index", "group_id", "teacher_id", "week", "capable", "ranked_bits")
+
+    def __init__(self, teacher_agent, class_index: int, capable: int, ranked_bits: list):
+        owned_class = teacher_agent.owned_classes[class_index]
+        self.teacher_agent = teacher_agent
+        self.class_index = class_index
+        self.group_id = owned_class["group_id"]
+        self.teacher_id = teacher_agent.get_id()
+        self.week = owned_class["week"]
+        self.capable = capable
+        self.ranked_bits = ranked_bits
+
+#   Branch and bound over the classes the agents would negotiate. A value is a cell of the class's week
+#   and a room, domains are cell bitsets, and leaving a class unplaced is always allowed at the cost
+#   of one failure, so the search maximizes the number of placed meetings.
+class ExactEngine(SolverEngine):
+    name = "exact"
+
+    def __init__(self, time_limit: float = 10.0, node_limit: int = 1000000, negotiation_engine: NegotiationEngine = None):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.negotiation_engine = negotiation_engine if negotiation_engine is not None else NegotiationEngine()
+        self.stats = None
+
+    def _make_variables(self, schedule_model):
+        room_agent = schedule_model.room_agent
+        layout = schedule_model.slot_layout
+        self.variables = []
+        self.domains = []
+
+        for teacher_id in schedule_model.teacher_ids:
+            teacher_agent = schedule_model.get_agent(teacher_id)
+            for class_index, owned_class in enumerate(teacher_agent.owned_classes):
+                if owned_class["solution"] != SolutionType.UNDEFINED: continue
+
+                week = owned_class["week"]
+                group_agent = schedule_model.get_agent(owned_class["group_id"])
+                capable = room_agent.capable_rooms(owned_class["type_id"], owned_class["tools"])
+                domain = group_agent.availability.week_mask(week) & teacher_agent.availability.week_mask(week)
+                for day_i, slot_i in layout.iter_cells(week, domain):
+                    if not capable & room_agent.free_rooms[day_i][slot_i]:
+                        domain &= ~(1 << layout.locate(day_i, slot_i)[1])
+
+#               Cells are tried in the order the group itself would rank them
+                ranked_bits = group_agent.rank_free_cells(week).tolist()
+                self.variables.append(ExactVariable(teacher_agent, class_index, capable, ranked_bits))
+                self.domains.append(domain)
+
+        self.group_vars = {}
+        self.teacher_vars = {}
+        self.room_vars = {}
+        for var_i, variable in enumerate(self.variables):
+            self.group_vars.setdefault((variable.group_id, variable.week), []).append(var_i)
+            self.teacher_vars.setdefault((variable.teacher_id, variable.week), []).append(var_i)
+            room_mask = variable.capable
+            while room_mask:
+                room_bit = room_mask & -room_mask
+                room_mask ^= room_bit
+                self.room_vars.setdefault((variable.week, room_bit.bit_length() - 1), []).append(var_i)
+
+        self.free_rooms = [
+            [room_agent.free_rooms[day_i][slot_i] for day_i, slot_i in layout.iter_cells(week, layout.full_week_mask)]
+            for week in range(layout.week_count)
+        ]
+
+#       Rooms every class can use in the same way are interchangeable, only one of them is branched on
+        capable_masks = sorted({variable.capable for variable in self.variables})
+        room_count = len(room_agent.owned_rooms)
+        self.room_kind = [tuple((capable >> room_i) & 1 for capable in capable_masks) for room_i in range(room_count)]
+#       Rooms fewer classes can use are handed out first
+        self.room_order = sorted(range(room_count), key=lambda room_i: sum(self.room_kind[room_i]))
+
+    def _lower_bound(self) -> int:
+        bounds = []
+        for var_groups in (self.group_vars, self.teacher_vars):
+            bound = 0
+            for var_ids in var_groups.values():
+                open_count = 0
+                union = 0
+                for var_i in var_ids:
+                    if self.values[var_i] is False:
+                        open_count += 1
+                        union |= self.domains[var_i]
+                bound += max(open_count - union.bit_count(), 0)
+            bounds.append(bound)
+        return max(bounds)
+
+    def _assign(self, var_i: int, bit: int, room_i: int):
+        variable = self.variables[var_i]
+        cell_bit = 1 << bit
+        domains = self.domains
+        values = self.values
+        trail = self.trail
+
+        for var_ids in (self.group_vars[(variable.group_id, variable.week)], self.teacher_vars[(variable.teacher_id, variable.week)]):
+            for other_i in var_ids:
+                if values[other_i] is False and domains[other_i] & cell_bit:
+                    trail.append((other_i, domains[other_i]))
+                    domains[other_i] &= ~cell_bit
+
+        week_rooms = self.free_rooms[variable.week]
+        trail.append((None, (variable.week, bit, week_rooms[bit])))
+        week_rooms[bit] &= ~(1 << room_i)
+        for other_i in self.room_vars[(variable.week, room_i)]:
+            if values[other_i] is False and domains[other_i] & cell_bit and not self.variables[other_i].capable & week_rooms[bit]:
+                trail.append((other_i, domains[other_i]))
+                domains[other_i] &= ~cell_bit
+
+    def _undo(self, trail_mark: int):
+        trail = self.trail
+        while len(trail) > trail_mark:
+            var_i, saved = trail.pop()
+            if var_i is None:
+                week, bit, free_rooms = saved
+                self.free_rooms[week][bit] = free_rooms
+            else:
+                self.domains[var_i] = saved
+
+    def _out_of_budget(self) -> bool:
+        if self.nodes >= self.node_limit: return True
+        if (self.nodes & 63) == 0 and time.perf_counter() - self.start_time >= self.search_limit:
+            self.timed_out = True
+        return self.timed_out
+
+    def _search(self, failures: int):
+        self.nodes += 1
+        if self._out_of_budget():
+            self.stopped = True
+            return
+
+        var_i = -1
+        var_size = None
+        for other_i, value in enumerate(self.values):
+            if value is False:
+                size = self.domains[other_i].bit_count()
+                if var_size is None or size < var_size:
+                    var_i, var_size = other_i, size
+                    if not size: break
+
+        if var_i < 0:
+            if failures < self.best_failures:
+                self.best_failures = failures
+                self.best_values = list(self.values)
+            return
+#       The bound can't exceed the open classes, so it's only worth computing once it could prune
+        if failures + self.open_count >= self.best_failures and failures + self._lower_bound() >= self.best_failures: return
+
+        variable = self.variables[var_i]
+        domain = self.domains[var_i]
+        week_rooms = self.free_rooms[variable.week]
+        for bit in variable.ranked_bits:
+            if not (domain >> bit) & 1: continue
+
+            pool = variable.capable & week_rooms[bit]
+            tried_kinds = set()
+            for room_i in self.room_order:
+                if not (pool >> room_i) & 1 or self.room_kind[room_i] in tried_kinds: continue
+                tried_kinds.add(self.room_kind[room_i])
+
+                trail_mark = len(self.trail)
+                self.values[var_i] = (bit, room_i)
+                self.open_count -= 1
+                self._assign(var_i, bit, room_i)
+                self._search(failures)
+                self._undo(trail_mark)
+                self.open_count += 1
+                self.values[var_i] = False
+                if self.stopped or self.best_failures <= self.root_bound: return
+
+        self.values[var_i] = None
+        self.open_count -= 1
+        self._search(failures + 1)
+        self.open_count += 1
+        self.values[var_i] = False
+
+    def solve(self, schedule_model) -> int:
+        self.start_time = time.perf_counter()
+#       The search can't use up more than the overall solving deadline either
+        self.search_limit = self.time_limit
+        if self.negotiation_engine.time_limit is not None:
+            self.search_limit = min(self.search_limit, self.negotiation_engine.time_limit)
+        self._make_variables(schedule_model)
+#       False marks an open variable, None an unplaced one, otherwise (week bit, room index)
+        self.values = [False] * len(self.variables)
+        self.open_count = len(self.variables)
+        self.trail = []
+        self.nodes = 0
+        self.stopped = False
+        self.timed_out = False
+        self.best_failures = len(self.variables) + 1
+        self.best_values = None
+        self.root_bound = self._lower_bound()
+
+#       The search goes one call deeper per class, which real sizes take past the default limit
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, len(self.variables) + 1000))
+        try:
+            self._search(0)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+#       The trail is unwound, so the domains are back to the root ones. A class is only skipped here when it
+#       has no cell at all or the search proved it can't be placed, the rest is left to the negotiation
+        layout = schedule_model.slot_layout
+        deferred_count = 0
+        for var_i, variable in enumerate(self.variables):
+            value = self.best_values[var_i] if self.best_values is not None else None
+            if value is not None:
+                day_i, slot_i = layout.cell_of(variable.week, value[0])
+                schedule_model.place_meeting(variable.teacher_agent, variable.class_index, day_i, slot_i, value[1])
+            elif not self.domains[var_i] or (self.best_values is not None and not self.stopped):
+                variable.teacher_agent.skip_class(variable.class_index)
+            else:
+                deferred_count += 1
+
+        self.stats = {
+            "variables": len(self.variables),
+            "nodes": self.nodes,
+            "failures": self.best_failures if self.best_values is not None else None,
+            "deferred": deferred_count,
+            "lower_bound": self.root_bound,
+            "optimal": not self.stopped,
+            "timed_out": self.timed_out,
+            "time": time.perf_counter() - self.start_time
+        }
+        schedule_model.trace.info("Exact search: {} nodes, {} unplaced, {} left to negotiate, bound {}, optimal: {}",
+            self.nodes, self.stats["failures"], deferred_count, self.root_bound, self.stats["optimal"])
+#       A search cut by the node limit is reproducible, one cut by the clock depends on the machine's load
+        if self.timed_out:
+            schedule_model.stopped = StopReason.TIME_LIMIT.name
+
+#       The model runs whatever is left, the classes the search didn't settle and the repair phase
+        schedule_model.skip_resolved_classes()
+        iterations = self.negotiation_engine.solve(schedule_model, self.start_time)
+        self.stats["negotiation"] = self.negotiation_engine.get_stats()
+        return iterations
+
+    def get_stats(self) -> dict:
+        return self.stats
@@ -0,0 +1,117 @@
+#   Pre-solve checks over the configs alone. Every number here is a necessary condition,
+#   so an overflow is a failure the solver can't avoid, while a fit doesn't promise a placement.
+
+def capable_room_names(class_info: dict, room_config: dict) -> frozenset:
+    return frozenset(
+        room_name for room_name, room_info in room_config.items()
+        if class_info["class_type"] in room_info["supported_class_types"]
+            and all(tool in room_info["tools"] for tool in class_info["tools"])
+    )
+
+def week_free_cells(main_config: dict, demand: int) -> int:
+#   Mirrors ScheduleModel._make_timeslots: slots past class_min_count are blocked until only the demand is left
+    day_count = len(main_config["week_days"])
+    slot_count = main_config["class_max_count"]
+    cell_count = day_count * slot_count
+    blockable = day_count * max(slot_count - main_config["class_min_count"], 0)
+    if demand >= cell_count: return cell_count
+    return cell_count - min(cell_count - demand, blockable)
+
+def analyze(main_config: dict, group_config: dict, room_config: dict) -> dict:
+    week_names = main_config["week_parity"]
+    week_count = len(week_names)
+    cell_count = len(main_config["week_days"]) * main_config["class_max_count"]
+
+    infeasible_classes = []
+    group_demand = {}
+    teacher_demand = {}
+    capability_demand = {}
+    capability_kinds = {}
+    for group_name, group_plan in group_config.items():
+        for class_name, class_info in group_plan.items():
+            times = list(class_info["times"])[:week_count]
+            times += [0] * (week_count - len(times))
+            capable_rooms = capable_room_names(class_info, room_config)
+
+            if not capable_rooms:
+                infeasible_classes.append({
+                    "group": group_name,
+                    "class": class_name,
+                    "class_type": class_info["class_type"],
+                    "tools": list(class_info["tools"]),
+                    "reason": "no_capable_room",
+                    "meetings": sum(times)
+                })
+                continue
+
+            group_times = group_demand.setdefault(group_name, [0] * week_count)
+            teacher_times = teacher_demand.setdefault(class_info["teacher"], [0] * week_count)
+            capability_times = capability_demand.setdefault(capable_rooms, [0] * week_count)
+            capability_kinds.setdefault(capable_rooms, set()).add((class_info["class_type"], tuple(sorted(class_info["tools"]))))
+            for week_i, time in enumerate(times):
+                group_times[week_i] += time
+                teacher_times[week_i] += time
+                capability_times[week_i] += time
+
+    groups = [
+        {"group": group_name, "week": week_names[week_i], "demand": demand,
+         "capacity": week_free_cells(main_config, demand), "overflow": max(demand - cell_count, 0)}
+        for group_name, group_times in group_demand.items()
+        for week_i, demand in enumerate(group_times)
+    ]
+    teachers = [
+        {"teacher": teacher_name, "week": week_names[week_i], "demand": demand,
+         "capacity": cell_count, "overflow": max(demand - cell_count, 0)}
+        for teacher_name, teacher_times in teacher_demand.items()
+        for week_i, demand in enumerate(teacher_times)
+    ]
+
+#   Every class whose rooms lie inside a room set competes for that set's room slots alone
+    capabilities = []
+    for room_names in capability_demand:
+        for week_i in range(week_count):
+            demand = sum(times[week_i] for other_rooms, times in capability_demand.items() if other_rooms <= room_names)
+            capacity = len(room_names) * cell_count
+            capabilities.append({"rooms": sorted(room_names), "class_kinds": sorted(capability_kinds[room_names]), "week": week_names[week_i], "demand": demand,
+                                 "capacity": capacity, "overflow": max(demand - capacity, 0)})
+
+    weeks = []
+    for week_i in range(week_count):
+        demand = sum(times[week_i] for times in capability_demand.values())
+        capacity = len(room_config) * cell_count
+        weeks.append({"week": week_names[week_i], "demand": demand, "capacity": capacity, "overflow": max(demand - capacity, 0)})
+
+#   Groups and teachers own disjoint sets of meetings, so their overflows add up, room sets overlap and don't
+    infeasible_count = sum(infeasible_class["meetings"] for infeasible_class in infeasible_classes)
+    failure_lower_bound = infeasible_count + max(
+        sum(group["overflow"] for group in groups),
+        sum(teacher["overflow"] for teacher in teachers),
+        max((capability["overflow"] for capability in capabilities + weeks), default=0)
+    )
+
+    return {
+        "week_cells": cell_count,
+        "meetings": infeasible_count + sum(sum(times) for times in group_demand.values()),
+        "infeasible_classes": infeasible_classes,
+        "groups": groups,
+        "teachers": teachers,
+        "capabilities": capabilities,
+        "weeks": weeks,
+        "failure_lower_bound": failure_lower_bound
+    }
+
+def print_report(report: dict):
+    print(f"Meetings: {report['meetings']}, slots per week: {report['week_cells']}")
+    print(f"Failed meetings lower bound: {report['failure_lower_bound']}\n")
+
+    for infeasible_class in report["infeasible_classes"]:
+        print(f"No room for {infeasible_class['group']} / {infeasible_class['class']} "
+              f"({infeasible_class['class_type']}, tools: {infeasible_class['tools']}), {infeasible_class['meetings']} meetings")
+
+    for section, name_key in (("groups", "group"), ("teachers", "teacher"), ("capabilities", "rooms")):
+        for row in report[section]:
+            if row["overflow"]:
+                print(f"{section[:-1].capitalize()} {row[name_key]} ({row['week']}): demand {row['demand']} > capacity {row['capacity']}")
+    for row in report["weeks"]:
+        if row["overflow"]:
+            print(f"All rooms ({row['week']}): demand {row['demand']} > capacity {row['capacity']}")
@@ -1,39 +1,376 @@
-from flask import Flask, render_template, request
+import json
+import threading
+from flask import Flask, Response, jsonify, render_template, request
+from event_trace import TraceLevel
+from datetime import date
+from entity_system import EntityKind
+from page_cache import PageCache, RenderedPage
+from schedule_decoder import VIEW_FIELDS
+from timetable_export import EXPORT_FORMATS, iter_export
+from solver_profile import to_prometheus
+from solve_jobs import CONFIG_NAMES, JobStatus
+from timeslot_store import FREE_CODE, BLOCKED_CODE
 
 schedule_model = None
 global_space = None
 timetables = None
+job_manager = None
+timetable_decoder = None
+default_configs = {}
+#   Requests are served on several threads, stepping and reading the model take turns
+model_lock = threading.Lock()
+page_cache = PageCache()
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_STEPS_PER_REQUEST = 10000
 
 app = Flask(__name__, template_folder="./pages")
 def run_flask_app():
-    app.run(use_reloader=False, debug=False, host="0.0.0.0", port=5000)
+    app.run(use_reloader=False, debug=False, host="0.0.0.0", port=5000, threaded=True)
+
+def _advance_model(count: int) -> int:
+    advanced = 0
+    while advanced < count and not schedule_model.schedule_ready():
+        schedule_model.step()
+        advanced += 1
+    return advanced
 
 @app.route("/debug", methods=["post", "get"])
 def render_debug_schedules():
-    global schedule_model
-
-    timeslots = schedule_model.get_group_timeslots()
-    room_timeslots = schedule_model.get_room_timeslots()
-    states = schedule_model.get_teacher_states()
-    message_log = schedule_model.get_message_log()
+    with model_lock:
+        if request.method == "POST":
+            _advance_model(1)
+        timeslots = schedule_model.get_group_timeslots()
+        room_timeslots = schedule_model.get_room_timeslots()
+        states = schedule_model.get_teacher_states()
+        message_log = schedule_model.get_message_log()
 
     return render_template("debug.html", 
         timeslots=timeslots,
         room_timeslots=room_timeslots,
         states=states, 
         message_log=message_log,
-        message_log_len=len(message_log))
+        message_log_len=len(message_log),
+        dropped_log_len=schedule_model.trace.dropped_count())
+
+def _int_arg(name: str, default: int, min_value: int, max_value: int = None) -> int:
+    value = request.values.get(name)
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get(name)
+    if value is None: return default
+    try: value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if value < min_value or (max_value is not None and value > max_value):
+        raise ValueError(f"{name} must be within [{min_value}, {max_value if max_value is not None else 'inf'}]")
+    return value
+
+def _page(items: list) -> dict:
+    offset = _int_arg("offset", 0, 0)
+    limit = _int_arg("limit", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    return {
+        "step": schedule_model.steps,
+        "total": len(items),
+        "offset": offset,
+        "limit": limit,
+        "items": items[offset:offset + limit]
+    }
+
+def _cell(class_code: int, teacher_code: int, room_code: int):
+    if class_code == FREE_CODE: return None
+    if class_code == BLOCKED_CODE: return "blocked"
+    return {"class": class_code, "teacher": teacher_code, "room": None if room_code == FREE_CODE else room_code}
+
+#   Pages are cut from id lists first, so only the grids on the requested page are built
+def _grid_page(entity_ids: list, to_item) -> dict:
+    page = _page(entity_ids)
+    page["items"] = [to_item(entity_id) for entity_id in page["items"]]
+    return page
+
+def _store_grid(entity_id: int) -> list:
+    store = schedule_model.get_timeslot_store()
+    row = store.row_of(entity_id)
+    return [
+        [_cell(class_code, teacher_code, room_code) for class_code, teacher_code, room_code in zip(class_row, teacher_row, room_row)]
+        for class_row, teacher_row, room_row in zip(store.class_codes[row].tolist(), store.teacher_codes[row].tolist(), store.room_codes[row].tolist())
+    ]
+
+@app.errorhandler(ValueError)
+def render_bad_argument(error):
+    return jsonify({"error": str(error)}), 400
+
+@app.route("/debug/api/groups", methods=["get"])
+def debug_groups():
+    with model_lock:
+        return jsonify(_grid_page(schedule_model.group_ids, lambda group_id: {
+            "id": group_id, "name": global_space.get(group_id), "grid": _store_grid(group_id)}))
+
+@app.route("/debug/api/rooms", methods=["get"])
+def debug_rooms():
+    with model_lock:
+        return jsonify(_grid_page(schedule_model.room_ids, lambda room_id: {
+            "id": room_id, "name": global_space.get(room_id), "grid": _store_grid(room_id)}))
+
+@app.route("/debug/api/teachers", methods=["get"])
+def debug_teachers():
+    def teacher_item(teacher_id: int) -> dict:
+        teacher_agent = schedule_model.get_agent(teacher_id)
+        return {
+            "id": teacher_id,
+            "name": global_space.get(teacher_id),
+            "state": teacher_agent.state.name,
+            "viewing_class": teacher_agent.viewing_class,
+            "classes": [
+                {"class": owned_class["id"], "group": owned_class["group_id"], "week": owned_class["week"],
+                 "solution": owned_class["solution"].name, "timeslot": owned_class["timeslot"]}
+                for owned_class in teacher_agent.owned_classes
+            ],
+            "grid": _store_grid(teacher_id)
+        }
+
+    with model_lock:
+        return jsonify(_grid_page(list(schedule_model.teacher_ids), teacher_item))
+
+@app.route("/debug/api/log", methods=["get"])
+def debug_log():
+    level = request.args.get("level", "DEBUG").upper()
+    if level not in TraceLevel.__members__:
+        raise ValueError(f"Unknown trace level {level}")
+
+    with model_lock:
+        events = schedule_model.trace.get_events(TraceLevel[level])
+        page = _page(events)
+        page["items"] = [{"step": event.step, "level": event.level.name, "text": event.format()} for event in page["items"]]
+        page["dropped"] = schedule_model.trace.dropped_count()
+        return jsonify(page)
+
+@app.route("/debug/api/step", methods=["post"])
+def debug_step():
+    count = _int_arg("count", 1, 1, MAX_STEPS_PER_REQUEST)
+    with model_lock:
+        advanced = _advance_model(count)
+        return jsonify({
+            "step": schedule_model.steps,
+            "advanced": advanced,
+            "ready": schedule_model.schedule_ready(),
+            "progress": schedule_model.get_progress()
+        })
+
+#   Cells changed after the given step. "complete": false means the journal has wrapped past it,
+#   and the viewer has to reload the grids through the paged endpoints
+@app.route("/debug/api/delta", methods=["get"])
+def debug_delta():
+    since_step = _int_arg("since", 0, 0)
+    with model_lock:
+        changes = schedule_model.get_cell_changes(since_step)
+        if changes is None:
+            return jsonify({"step": schedule_model.steps, "since": since_step, "complete": False, "cells": []})
+        return jsonify({
+            "step": schedule_model.steps,
+            "since": since_step,
+            "complete": True,
+            "cells": [
+                {"entity": entity_id, "kind": global_space.kind_of(entity_id).name, "day": day_i, "slot": slot_i,
+                 "cell": _cell(class_code, teacher_code, room_code)}
+                for entity_id, day_i, slot_i, class_code, teacher_code, room_code in changes
+            ]
+        })
+
+def _model_stats() -> dict:
+    message_stats = schedule_model.get_message_stats()
+    return {
+        "steps": schedule_model.steps,
+        "messages_routed": message_stats["routed"],
+        "max_pending_receivers": message_stats["max_pending_receivers"],
+        "owned_classes": schedule_model.owned_class_count(),
+        "completed_classes": schedule_model.completed_count(),
+        "failed_classes": schedule_model.failed_count(),
+        "preference_penalty": schedule_model.preference_penalty,
+        "timeslot_store_bytes": schedule_model.get_timeslot_store().nbytes()
+    }
+
+#   GET returns the counters, as Prometheus text with ?format=prometheus.
+#   POST switches collection with enabled=0/1 and clears the counters with reset=1
+@app.route("/metrics", methods=["post", "get"])
+def render_metrics():
+#   The profile is switched and read between model steps, never in the middle of one
+    with model_lock:
+        profile = schedule_model.get_profile()
+        if request.method == "POST":
+            enabled = request.values.get("enabled")
+            if enabled is not None:
+                profile.set_enabled(enabled.lower() in ("1", "true", "on"))
+            if request.values.get("reset") in ("1", "true", "on"):
+                profile.reset()
+
+        model_stats = _model_stats()
+        if request.args.get("format") == "prometheus":
+            return Response(to_prometheus(profile, model_stats), mimetype="text/plain; version=0.0.4")
+        return jsonify({"model": model_stats, "profile": profile.to_dict()})
+
+def _job_or_404(job_id: str):
+    job = job_manager.get(job_id) if job_manager is not None else None
+    if job is None:
+        return None, (jsonify({"error": f"Unknown job {job_id}"}), 404)
+    return job, None
+
+#   The body holds any of main_config, group_config, room_config, timepref_config and a seed,
+#   configs left out are the ones the server was started with
+@app.route("/jobs", methods=["post"])
+def submit_job():
+    if job_manager is None:
+        return jsonify({"error": "Job API is disabled"}), 503
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "JSON object expected"}), 400
+
+    configs = {config_name: body.get(config_name, default_configs.get(config_name)) for config_name in CONFIG_NAMES}
+    missing = [config_name for config_name, config in configs.items() if config is None]
+    if missing:
+        return jsonify({"error": f"Missing configs {missing}"}), 400
+    try: seed = int(body.get("seed", 0))
+    except (TypeError, ValueError): return jsonify({"error": "Seed must be an integer"}), 400
+
+    job = job_manager.submit(configs, seed)
+    response = jsonify(job.to_dict())
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return response, 200 if job.status == JobStatus.DONE else 202
+
+@app.route("/jobs", methods=["get"])
+def list_jobs():
+    if job_manager is None: return jsonify([])
+    return jsonify(job_manager.list_jobs())
+
+@app.route("/jobs/<job_id>", methods=["get"])
+def get_job(job_id: str):
+    job, error = _job_or_404(job_id)
+    if error is not None: return error
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>/result", methods=["get"])
+def get_job_result(job_id: str):
+    job, error = _job_or_404(job_id)
+    if error is not None: return error
+    if job.status == JobStatus.FAILED:
+        return jsonify({"error": job.error}), 500
+    if job.status != JobStatus.DONE:
+        return jsonify({"error": f"Job {job_id} is {job.status.name}"}), 409
+
+    result = job_manager.get_result(job)
+    if result is None:
+        return jsonify({"error": f"Result of job {job_id} is no longer cached, submit the job again"}), 410
+    return jsonify(result)
+
+#   Server-sent events: one "progress" event per change, a comment every 15 s to keep the stream open,
+#   and a final "done" or "failed" event
+@app.route("/jobs/<job_id>/events", methods=["get"])
+def stream_job_events(job_id: str):
+    job, error = _job_or_404(job_id)
+    if error is not None: return error
+
+    def generate():
+        version = -1
+        while True:
+            new_version, job_state = job_manager.wait_for_change(job, version, 15.0)
+            if new_version == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = new_version
+
+            if job_state["status"] in (JobStatus.DONE.name, JobStatus.FAILED.name):
+                yield f"event: {job_state['status'].lower()}\ndata: {json.dumps(job_state)}\n\n"
+                return
+            yield f"event: progress\ndata: {json.dumps(job_state)}\n\n"
+
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+EXPORT_CONTENT_TYPES = {
+    "jsonl": "application/x-ndjson; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+    "ics": "text/calendar; charset=utf-8"
+}
+VIEW_KINDS = {"group": EntityKind.GROUP, "teacher": EntityKind.TEACHER, "room": EntityKind.ROOM}
+
+#   ?format=jsonl|csv|ics&view=group|teacher|room, optionally &name= for one group, teacher or room.
+#   The body is streamed as the decoder walks the meetings
+@app.route("/export", methods=["get"])
+def export_timetable():
+    if timetable_decoder is None:
+        return jsonify({"error": "No timetable to export"}), 404
+
+    export_format = request.args.get("format", "jsonl")
+    view = request.args.get("view", "group")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}. Known formats: {list(EXPORT_FORMATS)}")
+    if view not in VIEW_FIELDS:
+        raise ValueError(f"Unknown timetable view {view}. Known views: {list(VIEW_FIELDS)}")
+
+    owner_id = None
+    owner_name = request.args.get("name")
+    if owner_name is not None:
+        owner_id = global_space.find(owner_name, VIEW_KINDS[view])
+        if owner_id is None:
+            return jsonify({"error": f"Unknown {view} {owner_name}"}), 404
+
+    options = {}
+    if export_format == "ics":
+        if request.args.get("term_start") is not None:
+            options["term_start"] = date.fromisoformat(request.args["term_start"])
+        options["term_weeks"] = _int_arg("term_weeks", 16, 1)
+
+#   The stream outlives the lock, so it reads a snapshot of the meetings and not a model that is being stepped
+    with model_lock:
+        decoder = timetable_decoder.snapshot()
+    chunks = iter_export(decoder, export_format, view, owner_id, **options)
+    headers = {"Content-Disposition": f'attachment; filename="timetable_{view}.{export_format}"'}
+    return Response(chunks, content_type=EXPORT_CONTENT_TYPES[export_format], headers=headers)
 
 @app.route("/space")
 def render_global_space():
     entities = global_space.get_entities()
-    entity_list_len = len(entities)
-    return render_template("space.html", entities=entities, entity_list_len=entity_list_len)
+    return render_template("space.html", entities=entities)
+
+def _render_index_page(page_index: int) -> str:
+    return render_template(
+        "index.html", 
+        timetable=timetables[page_index], 
+        page_index=page_index,
+        timetable_count=len(timetables))
+
+def _model_version() -> int:
+    return schedule_model.steps if schedule_model is not None else None
+
+def set_timetables(new_timetables: list):
+    global timetables
+    timetables = new_timetables
+    with app.test_request_context("/"):
+        page_cache.build(timetables, _render_index_page, _model_version())
+
+def _serve_page(page: RenderedPage) -> Response:
+    encoding = page.choose_encoding(request.accept_encodings)
+    headers = {"ETag": page.etags[encoding], "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    if page.matches(request.if_none_match, encoding):
+        return Response(status=304, headers=headers)
+    return Response(page.bodies[encoding], content_type=page.content_type, headers=headers)
+
+def _cached_pages():
+    with model_lock:
+#       A model stepped from /debug since the pages were rendered is decoded and rendered again
+        if timetable_decoder is not None and page_cache.version != _model_version():
+            set_timetables(timetable_decoder.decode())
+#       Timetables assigned directly instead of through set_timetables are rendered on first use
+        elif page_cache.timetables is not timetables:
+            set_timetables(timetables)
+    return page_cache
 
 @app.route("/", methods=["get"])
 def render_index():
-    global timetables
-    timetable_count = len(timetables)
+    cache = _cached_pages()
 
     page_index = request.args.get("page")
     if page_index is None: page_index = 0
@@ -41,11 +378,14 @@ def render_index():
         try: page_index = int(page_index)
         except: page_index = 0
 
-    if page_index < 0 or page_index >= timetable_count:
+    if page_index < 0 or page_index >= cache.page_count():
         page_index = 0
 
-    return render_template(
-        "index.html", 
-        timetable=timetables[page_index], 
-        page_index=page_index,
-        timetable_count=timetable_count)
\ No newline at end of file
+    return _serve_page(cache.html_pages[page_index])
+
+@app.route("/timetables/<int:page_index>", methods=["get"])
+def render_timetable_json(page_index: int):
+    cache = _cached_pages()
+    if page_index >= cache.page_count():
+        return jsonify({"error": f"No timetable {page_index}, there are {cache.page_count()}"}), 404
+    return _serve_page(cache.json_pages[page_index])
\ No newline at end of file
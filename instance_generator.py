@@ -0,0 +1,100 @@
+import json
+import os
+import random
+
+LECTURE_TYPE = "лек."
+LAB_TYPE = "лаб."
+
+BUNDLED_CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+BUNDLED_CONFIG_PATHS = ("main_config.json", "group_config.json", "room_config.json", "group_timeprefs.json")
+
+#   Instance sizes of the benchmark suite, "bundled" stands for the configs in config/
+INSTANCE_SIZES = {
+    "small": {"groups": 3, "teachers": 14, "rooms": 9, "tools": 3, "classes_per_group": 7, "week_parity": 2, "slots_per_day": 4},
+    "medium": {"groups": 12, "teachers": 40, "rooms": 24, "tools": 4, "classes_per_group": 7, "week_parity": 2, "slots_per_day": 5},
+    "large": {"groups": 40, "teachers": 120, "rooms": 70, "tools": 5, "classes_per_group": 8, "week_parity": 2, "slots_per_day": 6}
+}
+
+def _split_times(rng: random.Random, total: int, week_parity: int) -> list:
+    times = [0] * week_parity
+    for _ in range(total):
+        times[rng.randrange(week_parity)] += 1
+    return times
+
+def _lab_tools(rng: random.Random, tools: list) -> list:
+#   Same mix as group_config_generator: half the labs need one tool, a tenth need two
+    choice_num = rng.randint(1, 100)
+    if choice_num <= 50: return [rng.choice(tools[1:] or tools)]
+    elif choice_num <= 90: return []
+    return sorted(set(rng.sample(tools, min(2, len(tools)))))
+
+def generate_instance(groups: int, teachers: int, rooms: int, tools: int, classes_per_group: int,
+                      week_parity: int = 2, slots_per_day: int = 4, days_per_week: int = 6,
+                      min_class_times: int = 2, max_class_times: int = 4, seed: int = 0) -> tuple:
+    rng = random.Random(seed)
+    tool_names = [f"Инструмент {tool_i + 1}" for tool_i in range(tools)]
+    teacher_names = [f"Преподаватель {teacher_i + 1}" for teacher_i in range(teachers)]
+    slot_count = days_per_week * slots_per_day
+
+    main_config = {
+        "class_min_count": min(2, slots_per_day),
+        "class_max_count": slots_per_day,
+        "week_parity": [f"Неделя {week_i + 1}" for week_i in range(week_parity)],
+        "week_days": [f"День {day_i + 1}" for day_i in range(days_per_week)],
+        "class_times": [f"Пара {slot_i + 1}" for slot_i in range(slots_per_day)]
+    }
+
+#   A third of the rooms are lecture halls with the first tool, the rest are labs with a few tools each
+    room_config = {}
+    for room_i in range(rooms):
+        if room_i % 3 == 0:
+            room_config[f"Ауд. {room_i + 1}"] = {"supported_class_types": [LECTURE_TYPE], "tools": tool_names[:1]}
+        else:
+            room_tools = sorted(set(rng.sample(tool_names, rng.randint(1, len(tool_names)))) | {tool_names[room_i % len(tool_names)]})
+            room_config[f"Ауд. {room_i + 1}"] = {"supported_class_types": [LAB_TYPE, LECTURE_TYPE] if room_i % 3 == 1 else [LAB_TYPE], "tools": room_tools}
+
+    group_config = {}
+    timepref_config = {}
+    for group_i in range(groups):
+        group_name = f"Группа {group_i + 1}"
+        group_config[group_name] = {}
+        timepref_config[group_name] = [[rng.random() for _ in range(slots_per_day)] for _ in range(days_per_week * week_parity)]
+
+        for class_i in range(classes_per_group):
+            priority = rng.random()
+            for class_type in (LECTURE_TYPE, LAB_TYPE):
+                class_tools = rng.choice([tool_names[:1], []]) if class_type == LECTURE_TYPE else _lab_tools(rng, tool_names)
+                group_config[group_name][f"Дисциплина {class_i + 1}, {class_type}"] = {
+                    "class_type": class_type,
+                    "times": _split_times(rng, rng.randint(min_class_times, max_class_times), week_parity),
+                    "teacher": rng.choice(teacher_names),
+                    "tools": class_tools,
+                    "priority": priority
+                }
+
+#       Keeps the generated plan within the slots a group has in a week, like real study plans are
+        for week_i in range(week_parity):
+            week_plan = [class_info for class_info in group_config[group_name].values() if class_info["times"][week_i]]
+            while sum(class_info["times"][week_i] for class_info in week_plan) > slot_count:
+                class_info = rng.choice(week_plan)
+                class_info["times"][week_i] -= 1
+                if not class_info["times"][week_i]: week_plan.remove(class_info)
+
+    return main_config, group_config, room_config, timepref_config
+
+def generate_sized_instance(size_name: str, seed: int = 0) -> tuple:
+    if size_name not in INSTANCE_SIZES:
+        raise Exception(f"Unknown instance size {size_name}. Known sizes: {list(INSTANCE_SIZES)}")
+    return generate_instance(**INSTANCE_SIZES[size_name], seed=seed)
+
+#   Same four configs main.py starts from, read without importing the Flask entry point
+def load_bundled_instance() -> tuple:
+    configs = []
+    for config_path in BUNDLED_CONFIG_PATHS:
+        with open(os.path.join(BUNDLED_CONFIG_DIR, config_path), encoding="utf-8") as config_file:
+            configs.append(json.load(config_file))
+    return tuple(configs)
+
+def load_instance(instance_name: str) -> tuple:
+    if instance_name == "bundled": return load_bundled_instance()
+    return generate_sized_instance(instance_name)
@@ -1,11 +1,15 @@
+import argparse
 import json
 import os
 import sys
-from datetime import datetime
-from schedudle_model import ScheduleModel, TeacherState
+from datetime import date, datetime
 from entity_system import Space
-from schedule_decoder import ScheduleDecoder
-from flask import Flask
+from schedule_runner import make_schedule_model, make_decoder, build_schedule, print_progress, solve_best_of
+from warm_start import load_timetable, timetable_meetings
+from feasibility_analyzer import analyze, print_report
+from timetable_export import EXPORT_FORMATS, iter_export, write_export
+from schedule_decoder import VIEW_FIELDS
+from solve_jobs import JobManager
 import flask_routes
 
 main_config_path = "main_config.json"
@@ -28,36 +32,51 @@ def load_config(config_path: str) -> dict:
     
     return input_dict
 
-def make_timeslots(day_count, class_count):
-    timeslots = []
-    for i in range(day_count):
-        day = [None for _ in range(class_count)]
-        timeslots.append(day)
-    return timeslots
-
-def build_schedule(schedule_model: ScheduleModel):
-    iterations = 0
-    while not schedule_model.schedule_ready():
-        schedule_model.step()
-        iterations += 1
-    
-    owned_class_count = schedule_model.owned_class_count()
-    failed_solution_count = schedule_model.failed_count()
-    completed_solution_count = schedule_model.completed_count()
-    completed_percent = f"{((completed_solution_count / owned_class_count) * 100):.2f}"
-    failed_percent = f"{((failed_solution_count / owned_class_count) * 100):.2f}"
-
-    print(f"Iteration count: {iterations}\n")
-    print(f"Owned class count: {owned_class_count}")
-    print(f"Completed solutions: {completed_percent}% ({completed_solution_count})")
-    print(f"Failed solutions: {failed_percent}% ({failed_solution_count})\n")
-
 def save_timetable(output_dir: str, timetable):
     current_time = datetime.now().strftime("%d-%m-%Y_%H%M%S-%f")
 
     with open(os.path.join(output_dir, f"timetable_{current_time}.json"), "w", encoding = "utf-8") as timetable_file:
         json.dump(timetable, timetable_file, indent=4, ensure_ascii=False)
 
+def parse_args(solver_config: dict) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Builds the timetable and serves it")
+    parser.add_argument("--seed", type=int, default=solver_config.get("seed", 0),
+                        help="seed of the agent activation order, the first one when several seeds are tried")
+    parser.add_argument("--seeds", type=int, default=solver_config.get("seeds", 1),
+                        help="number of consecutive seeds to solve, the best schedule is kept, can't be combined with --step-by-step")
+    parser.add_argument("--workers", type=int, default=solver_config.get("workers", None),
+                        help="worker processes for multi-seed solving, all cores by default")
+    parser.add_argument("--warm-start", default=None,
+                        help="timetable saved by an earlier run, its meetings that still fit the config are kept")
+    parser.add_argument("--save", action="store_true",
+                        help="save the built timetable to the output directory")
+    parser.add_argument("--engine", choices=["negotiation", "exact"], default=solver_config.get("engine", "negotiation"),
+                        help="agent negotiation or the exact branch and bound search")
+    budget_config = solver_config.get("budget", {})
+    parser.add_argument("--time-limit", type=float, default=budget_config.get("time_limit", None),
+                        help="seconds a single solve may take, the schedule built so far is kept when it runs out")
+    parser.add_argument("--step-limit", type=int, default=budget_config.get("step_limit", None),
+                        help="model steps a single solve may take")
+    parser.add_argument("--profile", action="store_true",
+                        help="collect per state and per message type counters, served at /metrics")
+    parser.add_argument("--step-by-step", action="store_true",
+                        help="don't solve before serving, the model is advanced from /debug or /debug/api/step, needs a single seed")
+    parser.add_argument("--export", nargs="+", choices=EXPORT_FORMATS, default=[],
+                        help="also write the timetable to the output directory in these formats")
+    parser.add_argument("--export-view", choices=list(VIEW_FIELDS), default="group",
+                        help="whose timetables the exported meetings are ordered by")
+    parser.add_argument("--term-start", type=date.fromisoformat, default=None,
+                        help="Monday of the first week for the iCalendar export, YYYY-MM-DD, this week by default")
+    parser.add_argument("--term-weeks", type=int, default=16,
+                        help="weeks the iCalendar events repeat for")
+    parser.add_argument("--analyze", action="store_true",
+                        help="only report demand against capacity and the classes that can't be placed")
+
+    args = parser.parse_args()
+    if args.seeds > 1 and args.step_by_step:
+        parser.error("--step-by-step steps a single model, it can't be used with --seeds above 1")
+    return args
+
 def main():
     global schedule_model
     global global_space
@@ -66,29 +85,67 @@ def main():
     group_config = load_config(group_config_path)
     room_config = load_config(room_config_path)
     timepref_config = load_config(timepref_config_path)
+    args = parse_args(main_config.get("solver", {}))
+
+    if args.analyze:
+        print_report(analyze(main_config, group_config, room_config))
+        return
+    main_config.setdefault("solver", {})["engine"] = args.engine
+    budget_config = main_config["solver"].setdefault("budget", {})
+    budget_config["time_limit"] = args.time_limit
+    budget_config["step_limit"] = args.step_limit
+    if args.profile:
+        main_config.setdefault("profile", {})["enabled"] = True
+    if args.step_by_step:
+        main_config.setdefault("debug", {})["journal"] = True
+
+    warm_start = None
+    if args.warm_start is not None:
+        warm_start = timetable_meetings(main_config, load_timetable(args.warm_start))
 
-    week_day_count = len(main_config["week_days"])
-    week_parity = len(main_config["week_parity"])
-    period_size = week_day_count * week_parity
-    empty_timeslots = {
-        "class_min_count": main_config["class_min_count"],
-        "timeslots": make_timeslots(period_size, main_config["class_max_count"])
-    }
-
-    model_config = {"group_config": group_config, "room_config": room_config, "timepref_config": timepref_config}
-    schedule_model = ScheduleModel(empty_timeslots, week_parity, model_config, global_space)
-    
     print("Building schedule...")
-    build_schedule(schedule_model)
-
-    decoder = ScheduleDecoder(main_config, global_space, schedule_model.get_group_timeslots())
+    if args.seeds > 1:
+        seeds = list(range(args.seed, args.seed + args.seeds))
+        schedule_model = solve_best_of(main_config, group_config, room_config, timepref_config, global_space, seeds, args.workers, warm_start=warm_start)
+        print(f"Best seed: {schedule_model.seed}")
+    else:
+        schedule_model = make_schedule_model(main_config, group_config, room_config, timepref_config, global_space, args.seed, warm_start)
+        if not args.step_by_step:
+            build_schedule(schedule_model, progress_callback=print_progress)
+
+    decoder = make_decoder(main_config, schedule_model, global_space)
     timetables = decoder.decode()
-    #save_timetable(output_dir, timetables)
+    if args.save:
+        os.makedirs(output_dir, exist_ok=True)
+        save_timetable(output_dir, timetables)
+    if args.export:
+        os.makedirs(output_dir, exist_ok=True)
+        current_time = datetime.now().strftime("%d-%m-%Y_%H%M%S-%f")
+        for export_format in args.export:
+            options = {"term_start": args.term_start, "term_weeks": args.term_weeks} if export_format == "ics" else {}
+            export_path = os.path.join(output_dir, f"timetable_{args.export_view}_{current_time}.{export_format}")
+            write_export(export_path, iter_export(decoder, export_format, args.export_view, **options))
+            print(f"Exported {decoder.meeting_count()} meetings to {export_path}")
 
     flask_routes.global_space = global_space
     flask_routes.schedule_model = schedule_model
-    flask_routes.timetables = timetables
-    flask_routes.run_flask_app()
+    flask_routes.set_timetables(timetables)
+    flask_routes.timetable_decoder = decoder
+
+    job_config = main_config.get("jobs", {})
+    if job_config.get("enabled", False):
+        flask_routes.default_configs = {
+            "main_config": main_config,
+            "group_config": group_config,
+            "room_config": room_config,
+            "timepref_config": timepref_config
+        }
+        flask_routes.job_manager = JobManager(job_config.get("workers"), job_config.get("cache_size", 32), job_config.get("max_jobs", 256))
+    try:
+        flask_routes.run_flask_app()
+    finally:
+        if flask_routes.job_manager is not None:
+            flask_routes.job_manager.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,59 @@
+import gzip
+import hashlib
+import json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#   One representation of a page, kept in every encoding it can be sent in.
+#   Each encoding gets its own strong ETag, since the bytes on the wire differ
+class RenderedPage:
+    __slots__ = ("content_type", "bodies", "etags")
+
+    def __init__(self, body: bytes, content_type: str):
+        self.content_type = content_type
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body)
+
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etags = {encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"' for encoding in self.bodies}
+
+    def choose_encoding(self, accept_encodings) -> str:
+        best_encoding = "identity"
+        best_quality = 0.0
+        for encoding in ("br", "gzip"):
+            quality = accept_encodings[encoding]
+            if encoding in self.bodies and quality > best_quality:
+                best_encoding, best_quality = encoding, quality
+        return best_encoding
+
+    def matches(self, if_none_match, encoding: str) -> bool:
+#       If-None-Match compares weakly, so a W/ prefix on the client's tag doesn't matter
+        return if_none_match.contains_weak(self.etags[encoding].strip('"'))
+
+#   Timetables don't change after solving, so every page is rendered and compressed once up front.
+#   version tells which state of the model the pages show, a model that is still being stepped outdates them
+class PageCache:
+    def __init__(self):
+        self.timetables = None
+        self.version = None
+        self.html_pages = []
+        self.json_pages = []
+
+    def build(self, timetables: list, render_html, version = None):
+        self.timetables = timetables
+        self.version = version
+        self.html_pages = [
+            RenderedPage(render_html(page_index).encode("utf-8"), "text/html; charset=utf-8")
+            for page_index in range(len(timetables))
+        ]
+        self.json_pages = [
+            RenderedPage(json.dumps(timetable, ensure_ascii=False).encode("utf-8"), "application/json")
+            for timetable in timetables
+        ]
+
+    def page_count(self) -> int:
+        return len(self.html_pages)
@@ -1,10 +1,16 @@
 import copy
 import random
-import mesa
+import time
+from collections import deque
+import numpy as np
 from mesa import Agent, Model
 from enum import Enum
-from abc import abstractmethod
-from entity_system import Space, IdDecoder
+from entity_system import Space, EntityKind
+from event_trace import EventTrace, TraceLevel
+from solver_engine import StopReason
+from solver_profile import SolverProfile
+from availability import SlotLayout, AvailabilityMask, mask_bits, mask_flags
+from timeslot_store import TimeslotStore, TimeslotView, FREE_CODE, BLOCKED_CODE
 
 def get_intersection(dict1: dict, dict2: dict) -> set:
     intersection = {}
@@ -17,6 +23,12 @@ def week_num(day: int, parity_rank: int, period_len: int):
     day_per_week = period_len // parity_rank
     return day // day_per_week
 
+#   A gap is a free slot between the first and the last meeting of a day
+def gap_slots(class_codes: list) -> list:
+    meeting_slots = [slot_i for slot_i, class_code in enumerate(class_codes) if class_code >= 0]
+    if not meeting_slots: return []
+    return [slot_i for slot_i in range(meeting_slots[0] + 1, meeting_slots[-1]) if class_codes[slot_i] == FREE_CODE]
+
 class AgentType(Enum):
     TEACHER =   0,
     GROUP =     1,
@@ -35,7 +47,8 @@ class MessageType(Enum):
     CANCEL_MEETING = 9,
     WHEREGAPS = 10,
     USERGAPS = 11,
-    SET_STATE = 12
+    SET_STATE = 12,
+    TIMEPROPOSALS = 13
 
 class TeacherState(Enum):
     ASK_WHEN_AVAIL = 0,
@@ -52,6 +65,7 @@ class TeacherState(Enum):
 class DeaneryState(Enum):
     ASK_GAPS = 0,
     FIND_FREE_TEACHERS = 1,
+    WAIT_FOR_TEACHERS = 2,
 
     WORK_ENDED = 10
 
@@ -60,7 +74,13 @@ class SolutionType(Enum):
     UNDEFINED = 1,
     SOLUTION_FOUND = 2
 
+class RejectReason(Enum):
+    BUSY = 0,
+    NEVER = 1
+
 class Message:
+    __slots__ = ("type", "content", "sender_id", "receiver_id")
+
     def __init__(self, type, content, sender_id = None, receiver_id = None):
         self.type = type
         self.content = content
@@ -89,52 +109,88 @@ class SendingAgent(Agent):
     def __init__(self, self_id, model):
         super().__init__(model)
         self.self_id = self_id
-        self.message_box = []
+        self.message_box = deque()
+        self.replies = deque()
 
     def get_id(self):
         return self.self_id
 
-    def send_message(self, message: Message, receiver_id: int, id_is_index = False):
+    def send_message(self, message: Message, receiver_id: int):
         message.set_sender(self.self_id)
         message.set_receiver(receiver_id)
-        
-        if id_is_index:
-            self.model.sending_agents[receiver_id].receive_message(message)
-        else:
-            for agent in self.model.sending_agents:
-                if agent.get_id() == receiver_id:
-                    log_part = f"{type(self).__name__}[{self.get_id()}] -> {type(agent).__name__}[{agent.get_id()}] : {message.get_type().name}"
-                    self.model.log_message(log_part)
-                    agent.receive_message(message)
-                    break
+
+        agent = self.model.get_agent(receiver_id)
+        if agent is None:
+            raise Exception(f"Agent [{self.get_id()}] sent {message.get_type().name} to unknown agent [{receiver_id}]!")
+
+        profile = self.model.profile
+        mark = profile.begin() if profile.enabled else None
+
+        trace = self.model.trace
+        if trace.debug_enabled:
+            trace.debug("{}[{}] -> {}[{}] : {}",
+                type(self).__name__, self.self_id, type(agent).__name__, receiver_id, message.get_type().name)
+        self.model.post_message(agent, message)
+
+        if mark is not None:
+            profile.end_send(message.type, mark, message.type == MessageType.REJECT)
+
+    def request(self, message: Message, receiver_id: int) -> Message:
+        if self.model.delivering:
+            raise Exception(f"Agent [{self.get_id()}] can't wait for a reply while messages are being delivered!")
+
+        self.send_message(message, receiver_id)
+        self.model.deliver_messages()
+        return self.pop_last_message()
+
+    def multicast(self, message: Message, receiver_ids):
+        for receiver_id in receiver_ids:
+            self.send_message(Message(message.get_type(), message.get_content()), receiver_id)
+
+    def broadcast(self, message: Message, kind: EntityKind = None):
+        receiver_ids = [agent_id for agent_id in self.model.get_agent_ids(kind) if agent_id != self.self_id]
+        self.multicast(message, receiver_ids)
     
-    @abstractmethod
-    def on_receive(self): pass
+    def on_receive(self, message: Message):
+        self.replies.append(message)
+
+    def is_active(self) -> bool:
+        return False
 
     def receive_message(self, message: Message):
         self.message_box.append(message)
-        self.on_receive()
+
+    def process_messages(self) -> int:
+        message_box = self.message_box
+        profile = self.model.profile
+        processed_count = 0
+        while message_box:
+            message = message_box.popleft()
+            if profile.enabled:
+                mark = profile.begin()
+                self.on_receive(message)
+                profile.end_handler(type(self).__name__, message.type, mark)
+            else:
+                self.on_receive(message)
+            processed_count += 1
+        return processed_count
     
     def get_last_message(self) -> Message:
-        return self.message_box[-1]
+        return self.replies[-1]
     
     def pop_last_message(self) -> Message:
-        if not len(self.message_box): return None
-        else: return self.message_box.pop()
+        if not len(self.replies): return None
+        else: return self.replies.pop()
 
 class ClassInfo:
     def __init__(self, class_name: str, class_info: dict, group_id: int, global_space: Space):
-        self.id = global_space.match(class_name)
+        self.id = global_space.match(class_name, EntityKind.CLASS)
         self.group_id = group_id
-        self.type_id = global_space.match(class_info["class_type"])
+        self.type_id = global_space.match(class_info["class_type"], EntityKind.CLASS_TYPE)
         self.times = ()
         self.priority = class_info["priority"]
 
-        class_tools = []
-        for tool in class_info["tools"]:
-            tool_id = global_space.match(tool)
-            class_tools.append(tool_id)
-        self.tools = tuple(class_tools)
+        self.tools = tuple(global_space.match_many(class_info["tools"], EntityKind.TOOL))
     
     def to_string(self) -> str:
         return f"class_id: {self.id} times: {self.times}" #group_id: {self.group_id}, type_id: {self.type}, times: {self.times}, tools: {self.tools}"
@@ -150,29 +206,43 @@ class ClassInfo:
         return self.to_string()
     
 class TeacherAgent(SendingAgent):
-    def _next_class(self, mark_previous_as):
-        self.owned_classes[self.viewing_class]["solution"] = mark_previous_as
+    def _set_solution(self, class_index: int, solution: SolutionType):
+        owned_class = self.owned_classes[class_index]
+        self.model.count_solution(owned_class["solution"], solution)
+        owned_class["solution"] = solution
+
+    def _next_class(self, mark_previous_as, timeslot: tuple = None):
+        self._set_solution(self.viewing_class, mark_previous_as)
+        if timeslot is not None:
+            owned_class = self.owned_classes[self.viewing_class]
+            owned_class["timeslot"] = timeslot
+            self.model.count_placement(owned_class, timeslot)
         self.viewing_class += 1
+        self.skip_resolved_classes()
+        
+        self.groups_subjprefs = iter(())
+        self.current_subjpref = None
+
+#   Classes resolved before negotiation (warm start, infeasible classes) are passed over
+    def skip_resolved_classes(self):
+        if self.state == TeacherState.WORK_ENDED: return
+        while self.viewing_class < len(self.owned_classes) and self.owned_classes[self.viewing_class]["solution"] != SolutionType.UNDEFINED:
+            self.viewing_class += 1
 
         if self.viewing_class >= len(self.owned_classes):
             self.state = TeacherState.WORK_ENDED
+            self.model.finished_teacher_count += 1
 #           print(f"Teacher {self.get_id()} ended working!")
         else:
             self.state = TeacherState.ASK_WHEN_AVAIL
-        
-        self.groups_subjprefs = []
-        self.current_subjpref_index = 0
 
-    def _has_intersection(self, timeslots2: list, week: int, class_id) -> bool:
-        parity_rank = self.model.get_parity_rank()
+    def _has_intersection(self, week_mask2: int, week: int) -> bool:
+        return self.availability.week_mask(week) & week_mask2 != 0
 
-        for day_i, day in enumerate(self.timeslots):
-            for slot_i, slot in enumerate(day):
-                if week == week_num(day_i, parity_rank, len(self.timeslots)) and slot == class_id and timeslots2[day_i][slot_i] == class_id:
-                    return True
-        return False
+    def _next_subjpref(self):
+        self.current_subjpref = next(self.groups_subjprefs, None)
 
-    def __init__(self, model, self_id, timeslots, owned_classes, owned_groups):
+    def __init__(self, model, self_id, timeslots: TimeslotView, owned_classes, owned_groups):
         if not isinstance(owned_classes, list):
             owned_classes = [owned_classes]
         if not isinstance(owned_groups, list):
@@ -183,12 +253,13 @@ class TeacherAgent(SendingAgent):
         self.owned_classes = []
         self.owned_groups = owned_groups
         self.timeslots = timeslots
+        self.availability = AvailabilityMask(model.slot_layout, timeslots.free_flags())
 #       Step-dependent data
         self.viewing_class = 0
         self.state = TeacherState.ASK_WHEN_AVAIL
 #       State-dependent data
-        self.groups_subjprefs = []
-        self.current_subjpref_index = 0
+        self.groups_subjprefs = iter(())
+        self.current_subjpref = None
 
         for owned_class in owned_classes:
             for _ in range(owned_class.times[1]):
@@ -199,16 +270,74 @@ class TeacherAgent(SendingAgent):
                     "week": owned_class.times[0],
                     "tools": owned_class.tools,
                     "priority": owned_class.priority,
-                    "solution": SolutionType.UNDEFINED
+                    "solution": SolutionType.UNDEFINED,
+                    "timeslot": None
                 })
+        model.count_owned_classes(len(self.owned_classes))
 #        self.owned_classes.sort(key=lambda x: x["group_id"])
     
-    def on_receive(self): pass
-        #message = self.get_last_message()
-        #print("Teacher received a message of type ", message.get_type())
+    def _negotiate_class(self):
+        owned_class = self.owned_classes[self.viewing_class]
+        week = owned_class["week"]
+        group_id = owned_class["group_id"]
+        layout = self.model.slot_layout
+
+        response = self.request(Message(MessageType.WHENAVAIL, owned_class), group_id)
+        if response.get_type() != MessageType.USERAVAIL:
+            raise Exception(f"USERAVAIL expected. Got {response.get_type()}")
+        if not self._has_intersection(response.get_content(), week):
+            self._next_class(SolutionType.SOLUTION_NOT_FOUND)
+            return
+
+        response = self.request(Message(MessageType.EVALUATE, owned_class), group_id)
+        if response.get_type() != MessageType.SUBJPREFS:
+            raise Exception(f"SUBJPREFS expected. Got {response.get_type()}")
+        ranked_bits = response.get_content()
+        candidates = ranked_bits[mask_flags(self.availability.week_mask(week), layout.week_bit_count)[ranked_bits]]
+
+#       The group takes the first candidate it still has free, the room service then either hosts it
+#       or the meeting is cancelled and the search goes on from the next candidate
+        while len(candidates):
+            timeproposals = (owned_class["id"], week, candidates)
+            response = self.request(Message(MessageType.TIMEPROPOSALS, timeproposals), group_id)
+            if response.get_type() == MessageType.REJECT: break
+            elif response.get_type() != MessageType.ACCEPT:
+                raise Exception(f"ACCEPT or REJECT expected. Got {response.get_type()}")
+            day_i, slot_i, candidate_i = response.get_content()
+
+            response = self.request(Message(MessageType.LOCPROPOSAL, (owned_class, day_i, slot_i)), self.model.room_agent_id)
+            if response.get_type() == MessageType.ACCEPT:
+                room_id = response.get_content()
+                self.timeslots.set_meeting(day_i, slot_i, owned_class["id"], self.self_id, room_id)
+                self.availability.occupy(day_i, slot_i)
+                self.send_message(Message(MessageType.FIXMEETING, (day_i, slot_i, room_id)), group_id)
+                self._next_class(SolutionType.SOLUTION_FOUND, (day_i, slot_i))
+                return
+            elif response.get_type() != MessageType.REJECT:
+                raise Exception(f"ACCEPT or REJECT expected. Got {response.get_type()}")
+
+            self.send_message(Message(MessageType.CANCEL_MEETING, (day_i, slot_i)), group_id)
+            if response.get_content() == RejectReason.NEVER: break
+            candidates = candidates[candidate_i + 1:]
+
+        self._next_class(SolutionType.SOLUTION_NOT_FOUND)
 
     def step(self):
-        if self.state == TeacherState.ASK_WHEN_AVAIL:
+        profile = self.model.profile
+        if not profile.enabled:
+            self._step_state()
+            return
+
+        state = self.state
+        mark = profile.begin()
+        self._step_state()
+        profile.end_state(state, mark)
+
+    def _step_state(self):
+        if self.model.fused_negotiation and self.state == TeacherState.ASK_WHEN_AVAIL:
+            self._negotiate_class()
+
+        elif self.state == TeacherState.ASK_WHEN_AVAIL:
             empty_intersection = True
 
             week = self.owned_classes[self.viewing_class]["week"]
@@ -218,11 +347,9 @@ class TeacherAgent(SendingAgent):
             request = Message(MessageType.WHENAVAIL, self.owned_classes[self.viewing_class])
             request.set_receiver(group_id)
             request.set_sender(self.get_id())
-            self.send_message(request, group_id)
-
-            response = self.pop_last_message()
+            response = self.request(request, group_id)
             if response.get_type() == MessageType.USERAVAIL:
-                empty_intersection = not self._has_intersection(response.get_content(), week, None) # !!!
+                empty_intersection = not self._has_intersection(response.get_content(), week)
             else:
                 raise Exception(f"USERAVAIL expected. Got {response.get_type()}")
             
@@ -237,17 +364,17 @@ class TeacherAgent(SendingAgent):
 
         elif self.state == TeacherState.ASK_SUBJ_PREFS:
             group_id = self.owned_classes[self.viewing_class]["group_id"]
-            self.groups_subjprefs = []
+            week = self.owned_classes[self.viewing_class]["week"]
 
             #for group_id in self.owned_groups:
             request = Message(MessageType.EVALUATE, self.owned_classes[self.viewing_class])
             request.set_receiver(group_id)
             request.set_sender(self.get_id())
-            self.send_message(request, group_id)
-
-            response = self.pop_last_message()
+            response = self.request(request, group_id)
             if response.get_type() == MessageType.SUBJPREFS:
-                self.groups_subjprefs += response.get_content()
+#               Candidates are unpacked lazily, one per proposal
+                self.groups_subjprefs = self.model.slot_layout.iter_ranked_cells(week, response.get_content())
+                self._next_subjpref()
             else:
                 raise Exception(f"SUBJPREFS expected. Got {response.get_type()}")
 
@@ -256,16 +383,13 @@ class TeacherAgent(SendingAgent):
         elif self.state == TeacherState.PROPOSE_TIME:
             group_id = self.owned_classes[self.viewing_class]["group_id"]
 
-            if not len(self.groups_subjprefs):
-                self.model.log_message(f"Teacher {self.get_id()} has empty groups_subjprefs!!!")
-
-            if self.current_subjpref_index >= len(self.groups_subjprefs):
+            subjpref = self.current_subjpref
+            if subjpref is None:
                 self.state = TeacherState.SOLNOT_FOUND
                 return
 
-            subjpref = self.groups_subjprefs[self.current_subjpref_index]
-            if not (self.timeslots[subjpref[0]][subjpref[1]] is None):
-                self.current_subjpref_index += 1
+            if not self.availability.is_free(subjpref[0], subjpref[1]):
+                self._next_subjpref()
                 return
 
             #for group_id in self.owned_groups:
@@ -273,19 +397,18 @@ class TeacherAgent(SendingAgent):
             request = Message(MessageType.TIMEPROPOSAL, timeproposal)
             request.set_receiver(group_id)
             request.set_sender(self.get_id())
-            self.send_message(request, group_id)
-
-            response = self.pop_last_message()
+            response = self.request(request, group_id)
             if response.get_type() == MessageType.ACCEPT:
-                self.timeslots[subjpref[0]][subjpref[1]] = [self.owned_classes[self.viewing_class]["id"], None]
+                self.timeslots.set_meeting(subjpref[0], subjpref[1], self.owned_classes[self.viewing_class]["id"], self.self_id)
+                self.availability.occupy(subjpref[0], subjpref[1])
                 self.state = TeacherState.PROPOSE_LOCATION
                 return
             elif response.get_type() == MessageType.REJECT:
-                self.model.log_message(f"Group {group_id} rejected {subjpref}!")
+                self.model.trace.debug("Group {} rejected {}!", group_id, subjpref)
             else:
                 raise Exception(f"ACCEPT or REJECT expected. Got {response.get_type()}")
 
-            self.current_subjpref_index += 1
+            self._next_subjpref()
         
         elif self.state == TeacherState.SOLNOT_FOUND:
 #           print(f"Teacher {self.get_id()} didn't find solution for this class!")
@@ -293,18 +416,16 @@ class TeacherAgent(SendingAgent):
         
         elif self.state == TeacherState.PROPOSE_LOCATION:
             group_id = self.owned_classes[self.viewing_class]["group_id"]
-            subjpref = self.groups_subjprefs[self.current_subjpref_index]
+            subjpref = self.current_subjpref
             locproposal = (self.owned_classes[self.viewing_class], subjpref[0], subjpref[1])
 
             request = Message(MessageType.LOCPROPOSAL, locproposal)
             request.set_receiver(self.model.room_agent_id)
             request.set_sender(self.get_id())
-            self.send_message(request, self.model.room_agent_id)
-
-            response = self.pop_last_message()
+            response = self.request(request, self.model.room_agent_id)
             if response.get_type() == MessageType.ACCEPT:
                 room_id = response.get_content()
-                self.timeslots[subjpref[0]][subjpref[1]][1] = room_id
+                self.timeslots.set_room(subjpref[0], subjpref[1], room_id)
 
                 group_request = Message(
                     MessageType.FIXMEETING,
@@ -314,15 +435,20 @@ class TeacherAgent(SendingAgent):
                 self.state = TeacherState.FIX_MEETING
 
             elif response.get_type() == MessageType.REJECT:
-                self.timeslots[subjpref[0]][subjpref[1]] = None
-                
+                self.timeslots.clear(subjpref[0], subjpref[1])
+                self.availability.release(subjpref[0], subjpref[1])
+
                 group_request = Message(
                     MessageType.CANCEL_MEETING, 
                     (subjpref[0], subjpref[1]), self.get_id(), group_id
                 )
                 self.send_message(group_request, group_id)
-                self.current_subjpref_index += 1
-                self.state = TeacherState.PROPOSE_TIME
+
+                if response.get_content() == RejectReason.NEVER:
+                    self.state = TeacherState.IMPOSS_MEETING
+                else:
+                    self._next_subjpref()
+                    self.state = TeacherState.PROPOSE_TIME
 
             else:
                 raise Exception(f"ACCEPT or REJECT expected. Got {response.get_type()}")
@@ -331,11 +457,71 @@ class TeacherAgent(SendingAgent):
             #for group_id in self.owned_groups:
                 #request = Message(MessageType.FIXMEETING, None, self.get_id(), group_id)
                 #self.send_message(request, group_id)
-            self._next_class(SolutionType.SOLUTION_FOUND)
+            self._next_class(SolutionType.SOLUTION_FOUND, self.current_subjpref)
 
     def count_owned_classes(self) -> int:
         return len(self.owned_classes)
 
+    def failed_classes(self) -> list:
+        return [class_i for class_i, owned_class in enumerate(self.owned_classes) if owned_class["solution"] == SolutionType.SOLUTION_NOT_FOUND]
+
+    def fix_class(self, class_index: int, day_i: int, slot_i: int, room_id: int):
+        owned_class = self.owned_classes[class_index]
+        self.timeslots.set_meeting(day_i, slot_i, owned_class["id"], self.self_id, room_id)
+        self.availability.occupy(day_i, slot_i)
+        self._set_solution(class_index, SolutionType.SOLUTION_FOUND)
+        owned_class["timeslot"] = (day_i, slot_i)
+        self.model.count_placement(owned_class, owned_class["timeslot"])
+
+    def skip_class(self, class_index: int):
+        self._set_solution(class_index, SolutionType.SOLUTION_NOT_FOUND)
+
+#   Stops negotiating mid-class: a fully reserved meeting is kept, a half reserved one is rolled back,
+#   and every class still undefined is marked as not found. Returns how many classes were given up
+    def abandon(self) -> int:
+        if self.state in (TeacherState.WORK_ENDED, TeacherState.TALK_TO_DEANERY): return 0
+
+        if self.state == TeacherState.FIX_MEETING:
+            self._next_class(SolutionType.SOLUTION_FOUND, self.current_subjpref)
+        elif self.state == TeacherState.PROPOSE_LOCATION:
+            day_i, slot_i = self.current_subjpref
+            self.timeslots.clear(day_i, slot_i)
+            self.availability.release(day_i, slot_i)
+            group_id = self.owned_classes[self.viewing_class]["group_id"]
+            self.send_message(Message(MessageType.CANCEL_MEETING, (day_i, slot_i)), group_id)
+
+        abandoned_count = 0
+        for class_index in range(self.viewing_class, len(self.owned_classes)):
+            if self.owned_classes[class_index]["solution"] == SolutionType.UNDEFINED:
+                self.skip_class(class_index)
+                abandoned_count += 1
+        self.skip_resolved_classes()
+
+        self.groups_subjprefs = iter(())
+        self.current_subjpref = None
+        return abandoned_count
+
+    def release_class(self, class_index: int):
+        owned_class = self.owned_classes[class_index]
+        day_i, slot_i = owned_class["timeslot"]
+        self.timeslots.clear(day_i, slot_i)
+        self.availability.release(day_i, slot_i)
+        self._set_solution(class_index, SolutionType.SOLUTION_NOT_FOUND)
+        self.model.count_placement(owned_class, owned_class["timeslot"], -1)
+        owned_class["timeslot"] = None
+
+    def on_receive(self, message: Message):
+        if message.get_type() == MessageType.SET_STATE:
+            self.state = message.get_content()
+            if self.state == TeacherState.TALK_TO_DEANERY:
+                response = Message(MessageType.ACCEPT, self.failed_classes(), self.get_id(), message.get_sender())
+                self.send_message(response, message.get_sender())
+        else:
+            self.replies.append(message)
+
+    def is_active(self) -> bool:
+        return self.state != TeacherState.WORK_ENDED
+
     def count_solutions_of_type(self, solution_type) -> int:
         count = 0
         for owned_class in self.owned_classes:
@@ -343,33 +529,63 @@ class TeacherAgent(SendingAgent):
         return count
 
 class GroupAgent(SendingAgent):
-    def __init__(self, model, self_id, timeslots, timeprefs):
+    def __init__(self, model, self_id, timeslots: TimeslotView, timeprefs):
         super().__init__(self_id, model)
         self.timeslots = timeslots
+        self.availability = AvailabilityMask(model.slot_layout, timeslots.free_flags())
         self.timeprefs = timeprefs
         self.planned_meetings = {}
-
-    def on_receive(self):
-        message = self.get_last_message()
-
+        self.week_prefs = self._make_week_prefs(timeprefs)
+        self.week_best = [prefs.max() for prefs in self.week_prefs] if self.week_prefs is not None else None
+
+    def _make_week_prefs(self, timeprefs) -> list:
+        layout = self.model.slot_layout
+        if timeprefs is None: return None
+
+        prefs = np.asarray(timeprefs, dtype=np.float64)
+        if prefs.shape != (layout.day_count, layout.slot_count):
+            self.model.trace.warning("Timeprefs of group {} have shape {}, expected {}. Ignoring them",
+                self.get_id(), prefs.shape, (layout.day_count, layout.slot_count))
+            return None
+
+#       Flattened per week so that a preference is indexed by the cell's bit in the week mask
+        return [
+            prefs[week * layout.day_per_week:(week + 1) * layout.day_per_week].reshape(-1)
+            for week in range(layout.week_count)
+        ]
+
+    def rank_free_cells(self, week: int) -> np.ndarray:
+        free_bits = mask_bits(self.availability.week_mask(week), self.model.slot_layout.week_bit_count)
+
+        if self.week_prefs is not None and len(free_bits):
+#           Most preferred cells first, equal ones in cell order
+            free_bits = free_bits[np.argsort(-self.week_prefs[week][free_bits], kind="stable")]
+
+        ranked_bits = free_bits.astype(np.int32)
+        ranked_bits.flags.writeable = False
+        return ranked_bits
+
+#   How much preference a class gives up in this cell against the group's best cell of the week,
+#   weighted by the class's priority, so important classes are the ones kept in preferred cells
+    def placement_cost(self, day_i: int, slot_i: int, priority: float) -> float:
+        if self.week_prefs is None: return 0.0
+        week, bit = self.model.slot_layout.locate(day_i, slot_i)
+        return priority * float(self.week_best[week] - self.week_prefs[week][bit])
+
+    def on_receive(self, message: Message):
         if message.get_type() == MessageType.WHENAVAIL:
-            response = Message(MessageType.USERAVAIL, self.timeslots)
+            week = message.get_content()["week"]
+            response = Message(MessageType.USERAVAIL, self.availability.week_mask(week))
             response.set_sender(self.get_id())
             response.set_receiver(message.get_sender())
             self.send_message(response, message.get_sender())
 
         elif message.get_type() == MessageType.EVALUATE:
-            subjpref = []
             week = message.get_content()["week"]
-            parity_rank = self.model.get_parity_rank()
-
-            for day_i in range(len(self.timeslots)):
-                for slot_i in range(len(self.timeslots[day_i])):
-                    if self.timeslots[day_i][slot_i] is None and week == week_num(day_i, parity_rank, len(self.timeslots)):
-                        subjpref.append((day_i, slot_i))
+            subjpref = self.rank_free_cells(week)
             
             if not len(subjpref):
-                self.model.log_message(f"{self.get_id()} has empty subjprefs!!!")
+                self.model.trace.warning("Group {} has empty subjprefs!", self.get_id())
             
             response = Message(MessageType.SUBJPREFS, subjpref)
             response.set_sender(self.get_id())
@@ -381,210 +597,560 @@ class GroupAgent(SendingAgent):
             day_i = message.get_content()[1]
             slot_i = message.get_content()[2]
 
-            if self.timeslots[day_i][slot_i] is None:
+            if self.availability.is_free(day_i, slot_i):
                 #self.planned_meetings[message.get_sender()] = (day_i, slot_i, None)
-                self.timeslots[day_i][slot_i] = [class_id, message.get_sender(), None]
+                self.timeslots.set_meeting(day_i, slot_i, class_id, message.get_sender())
+                self.availability.occupy(day_i, slot_i)
                 response = Message(MessageType.ACCEPT, None)
                 response.set_sender(self.get_id())
                 response.set_receiver(message.get_sender())
                 self.send_message(response, message.get_sender())
             else:
-#               print(f"Timeslot [{day_i}][{slot_i}] is {self.timeslots[day_i][slot_i]}")
                 response = Message(MessageType.REJECT, None, self.get_id(), message.get_sender())
                 self.send_message(response, message.get_sender())
 
+        elif message.get_type() == MessageType.TIMEPROPOSALS:
+            class_id, week, candidates = message.get_content()
+            layout = self.model.slot_layout
+            week_mask = self.availability.week_mask(week)
+
+            response = Message(MessageType.REJECT, None, self.get_id(), message.get_sender())
+            for candidate_i, bit in enumerate(candidates.tolist()):
+                if (week_mask >> bit) & 1:
+                    day_i, slot_i = layout.cell_of(week, bit)
+                    self.timeslots.set_meeting(day_i, slot_i, class_id, message.get_sender())
+                    self.availability.occupy(day_i, slot_i)
+                    response = Message(MessageType.ACCEPT, (day_i, slot_i, candidate_i), self.get_id(), message.get_sender())
+                    break
+            self.send_message(response, message.get_sender())
+
         elif message.get_type() == MessageType.FIXMEETING:
             day_i = message.get_content()[0]
             slot_i = message.get_content()[1]
             room_id = message.get_content()[2]
 
-            if not isinstance(self.timeslots[day_i][slot_i], list):
+            if not self.timeslots.is_meeting(day_i, slot_i):
                 raise Exception(f"Agent [{message.get_sender()}] tried to set meeting on unsuitable timeslot [{day_i}][{slot_i}] of group {self.get_id()}!")
             
-            self.timeslots[day_i][slot_i][2] = room_id
+            self.timeslots.set_room(day_i, slot_i, room_id)
         
         elif message.get_type() == MessageType.CANCEL_MEETING:
             day_i = message.get_content()[0]
             slot_i = message.get_content()[1]
 
-            if not isinstance(self.timeslots[day_i][slot_i], list):
+            if not self.timeslots.is_meeting(day_i, slot_i):
                 raise Exception(f"Agent [{message.get_sender()}] tried to cancel meeting on unsuitable timeslot [{day_i}][{slot_i}]!")
             
-            self.timeslots[day_i][slot_i] = None
+            self.timeslots.clear(day_i, slot_i)
+            self.availability.release(day_i, slot_i)
         
-        elif message.get_type() == MessageType.FIXMEETING:
-#            print("Meeting fixed")
-            pass
+        elif message.get_type() == MessageType.WHEREGAPS:
+            response = Message(MessageType.USERGAPS, self.find_gaps(), self.get_id(), message.get_sender())
+            self.send_message(response, message.get_sender())
     
     def step(self): pass
+
+    def find_gaps(self) -> list:
+        gaps = []
+        for day_i, class_codes in enumerate(self.timeslots.class_codes.tolist()):
+            gaps.extend((day_i, slot_i) for slot_i in gap_slots(class_codes))
+        return gaps
+
+    def fix_meeting(self, day_i: int, slot_i: int, class_id: int, teacher_id: int, room_id: int):
+        self.timeslots.set_meeting(day_i, slot_i, class_id, teacher_id, room_id)
+        self.availability.occupy(day_i, slot_i)
+
+    def cancel_meeting(self, day_i: int, slot_i: int):
+        self.timeslots.clear(day_i, slot_i)
+        self.availability.release(day_i, slot_i)
     
     def get_timeslots(self):
-        return self.timeslots
+        return self.timeslots.to_group_grid(self.model.slot_blocked_id)
 
 class RoomInfo:
-    def __init__(self, room_id: int, room_info: dict, timeslots, global_space: Space):
+    def __init__(self, room_id: int, room_info: dict, timeslots: TimeslotView, layout: SlotLayout, global_space: Space):
         self.id = room_id
-        self.supported_class_types = []
-        for type in room_info["supported_class_types"]:
-            type_id = global_space.match(type)
-            self.supported_class_types.append(type_id)
-
-        self.tools = []
-        for tool in room_info["tools"]:
-            tool_id = global_space.match(tool)
-            self.tools.append(tool_id)
+        self.supported_class_types = global_space.match_many(room_info["supported_class_types"], EntityKind.CLASS_TYPE)
+        self.tools = global_space.match_many(room_info["tools"], EntityKind.TOOL)
         
         self.timeslots = timeslots
+        self.availability = AvailabilityMask(layout, timeslots.free_flags())
     
     def avaible_for(self, locproposal) -> bool:
         class_info = locproposal[0]
 
         if not (class_info["type_id"] in self.supported_class_types): return False
         if not len(class_info["tools"]) == 0 and not all(tool in self.tools for tool in class_info["tools"]): return False
-        if not (self.timeslots[locproposal[1]][locproposal[2]] is None): return False
+        if not self.availability.is_free(locproposal[1], locproposal[2]): return False
 
         return True
 
 class RoomAgent(SendingAgent):
-    def __init__(self, model, self_id, timeslots, room_config, global_space: Space):
+    def __init__(self, model, self_id, room_config, global_space: Space):
         super().__init__(self_id, model)
 
         self.owned_rooms = []
+        self.room_index = {}
         for room_name, room_info in room_config.items():
-            room_id = global_space.match(room_name)
-            self.owned_rooms.append(RoomInfo(room_id, room_info, copy.deepcopy(timeslots), global_space))
+            room_id = global_space.match(room_name, EntityKind.ROOM)
+            self.room_index[room_id] = len(self.owned_rooms)
+            self.owned_rooms.append(RoomInfo(room_id, room_info, model.timeslot_store.view(room_id), model.slot_layout, global_space))
+
+#       Bit i of every room mask stands for owned_rooms[i], so the lowest bit is the first suitable room
+        all_rooms_mask = (1 << len(self.owned_rooms)) - 1
+        self.type_rooms = {}
+        self.tool_rooms = {}
+        for room_i, room in enumerate(self.owned_rooms):
+            for type_id in room.supported_class_types:
+                self.type_rooms[type_id] = self.type_rooms.get(type_id, 0) | (1 << room_i)
+            for tool_id in room.tools:
+                self.tool_rooms[tool_id] = self.tool_rooms.get(tool_id, 0) | (1 << room_i)
+        self.capability_index = {}
+
+        layout = model.slot_layout
+        self.free_rooms = [[all_rooms_mask] * layout.slot_count for _ in range(layout.day_count)]
+        for room_i, room in enumerate(self.owned_rooms):
+            for day_i, slot_i in zip(*(~room.timeslots.free_flags()).nonzero()):
+                self.free_rooms[day_i][slot_i] &= ~(1 << room_i)
     
     def step(self): pass
 
-    def on_receive(self):
-        message = self.get_last_message()
+    def capable_rooms(self, type_id: int, tools) -> int:
+        capability = (type_id, frozenset(tools))
+        rooms_mask = self.capability_index.get(capability)
 
+        if rooms_mask is None:
+            rooms_mask = self.type_rooms.get(type_id, 0)
+            for tool_id in capability[1]:
+                rooms_mask &= self.tool_rooms.get(tool_id, 0)
+            self.capability_index[capability] = rooms_mask
+        return rooms_mask
+
+    def hostable_rooms(self, class_info: dict, day_i: int, slot_i: int) -> int:
+        return self.capable_rooms(class_info["type_id"], class_info["tools"]) & self.free_rooms[day_i][slot_i]
+
+    def occupy_room(self, room_i: int, class_id: int, teacher_id: int, day_i: int, slot_i: int):
+        room = self.owned_rooms[room_i]
+        room.timeslots.set_meeting(day_i, slot_i, class_id, teacher_id, room.id)
+        room.availability.occupy(day_i, slot_i)
+        self.free_rooms[day_i][slot_i] &= ~(1 << room_i)
+
+    def release_room(self, room_i: int, day_i: int, slot_i: int):
+        room = self.owned_rooms[room_i]
+        room.timeslots.clear(day_i, slot_i)
+        room.availability.release(day_i, slot_i)
+        self.free_rooms[day_i][slot_i] |= 1 << room_i
+
+    def room_teacher(self, room_i: int, day_i: int, slot_i: int) -> int:
+        return int(self.owned_rooms[room_i].timeslots.teacher_codes[day_i, slot_i])
+
+    def on_receive(self, message: Message):
         if message.get_type() == MessageType.LOCPROPOSAL:
-            locproposal = message.get_content()
-            day_i = locproposal[1]
-            slot_i = locproposal[2]
-
-            for room in self.owned_rooms:
-                if room.avaible_for(locproposal):
-                    room.timeslots[day_i][slot_i] = locproposal[0]["id"]
-                    response = Message(MessageType.ACCEPT, room.id, self.get_id(), message.get_sender())
-                    self.send_message(response, message.get_sender())
-                    return
-            response = Message(MessageType.REJECT, None, self.get_id(), message.get_sender())
+            class_info, day_i, slot_i = message.get_content()
+            capable_mask = self.capable_rooms(class_info["type_id"], class_info["tools"])
+            hostable_mask = capable_mask & self.free_rooms[day_i][slot_i]
+
+            if hostable_mask:
+                room_i = (hostable_mask & -hostable_mask).bit_length() - 1
+                self.occupy_room(room_i, class_info["id"], message.get_sender(), day_i, slot_i)
+                response = Message(MessageType.ACCEPT, self.owned_rooms[room_i].id, self.get_id(), message.get_sender())
+            else:
+                reason = RejectReason.BUSY if capable_mask else RejectReason.NEVER
+                response = Message(MessageType.REJECT, reason, self.get_id(), message.get_sender())
             self.send_message(response, message.get_sender())
     
     def get_room_timeslots(self) -> dict:
         room_timeslots = {}
         for room in self.owned_rooms:
-            room_timeslots[room.id] = room.timeslots
+            room_timeslots[room.id] = room.timeslots.to_room_grid()
         return room_timeslots
 
 class DeaneryAgent(SendingAgent):
-    def __init__(self, teacher_ids, group_ids):
+    def __init__(self, model, self_id, teacher_ids, group_ids, repair_config: dict):
+        super().__init__(self_id, model)
         self.teacher_ids = teacher_ids
         self.group_ids = group_ids
-        self.completed_teachers_count = 0
         self.group_gaps = {}
-        self.corrector_id = None
-        self.state = DeaneryState.ASK_GAPS
-    
+        self.state = DeaneryState.WAIT_FOR_TEACHERS
+#       Budget of the repair phase, whichever runs out first ends it
+        self.max_moves = repair_config.get("max_moves", 20000)
+        self.time_budget = repair_config.get("time_budget", 1.0)
+#       (teacher id, day, slot) -> (teacher agent, class index) of every placed meeting
+        self.placed = {}
+        self.failed = deque()
+        self.gaps = deque()
+        self.talking_teachers = []
+        self.start_time = None
+        self.stats = {
+            "failed_before": 0,
+            "repaired": 0,
+            "gaps_before": 0,
+            "gaps_after": 0,
+            "moves_evaluated": 0,
+            "moves_applied": 0,
+            "inserts": 0,
+            "room_changes": 0,
+            "relocations": 0,
+            "swaps": 0,
+            "steps": 0,
+            "time": 0.0
+        }
+
+    def is_active(self) -> bool:
+        return self.state != DeaneryState.WORK_ENDED
+
+    def _budget_left(self) -> bool:
+        if self.stats["moves_evaluated"] >= self.max_moves: return False
+        if self.time_budget is None or time.perf_counter() - self.start_time < self.time_budget: return True
+#       How far the repair got depends on the machine's load now, so the result is marked as cut by the clock
+        if self.model.stopped is None:
+            self.model.stopped = StopReason.TIME_LIMIT.name
+            self.model.trace.warning("Repair stopped by its time budget after {} moves", self.stats["moves_evaluated"])
+        return False
+
+    def _meeting_at(self, timeslots: TimeslotView, day_i: int, slot_i: int) -> tuple:
+        if not timeslots.is_meeting(day_i, slot_i): return None
+        return self.placed[(int(timeslots.teacher_codes[day_i, slot_i]), day_i, slot_i)]
+
+    def _room_of(self, meeting: tuple) -> int:
+        teacher_agent, class_index = meeting
+        day_i, slot_i = teacher_agent.owned_classes[class_index]["timeslot"]
+        return self.room_agent.room_index[int(teacher_agent.timeslots.room_codes[day_i, slot_i])]
+
+    def _capable(self, meeting: tuple) -> int:
+        owned_class = meeting[0].owned_classes[meeting[1]]
+        return self.room_agent.capable_rooms(owned_class["type_id"], owned_class["tools"])
+
+    def _cost(self, owned_class: dict, day_i: int, slot_i: int) -> float:
+        return self.model.get_agent(owned_class["group_id"]).placement_cost(day_i, slot_i, owned_class["priority"])
+
+#   A move is a plan of ("remove", meeting) and ("place", meeting, day, slot, room index) operations.
+#   Its score only looks at the group days the plan touches: (placed delta, gap delta, preference delta)
+    def _score(self, plan: list) -> tuple:
+        placed_delta = 0
+        penalty_delta = 0.0
+        touched_days = {}
+        for operation in plan:
+            teacher_agent, class_index = operation[1]
+            owned_class = teacher_agent.owned_classes[class_index]
+            if operation[0] == "remove":
+                day_i, slot_i = owned_class["timeslot"]
+                class_code = FREE_CODE
+                placed_delta -= 1
+                penalty_delta -= self._cost(owned_class, day_i, slot_i)
+            else:
+                day_i, slot_i = operation[2], operation[3]
+                class_code = owned_class["id"]
+                placed_delta += 1
+                penalty_delta += self._cost(owned_class, day_i, slot_i)
+            touched_days.setdefault((owned_class["group_id"], day_i), {})[slot_i] = class_code
+
+        gap_delta = 0
+        for (group_id, day_i), changes in touched_days.items():
+            class_codes = self.model.get_agent(group_id).timeslots.class_codes[day_i].tolist()
+            gap_delta -= len(gap_slots(class_codes))
+            for slot_i, class_code in changes.items():
+                class_codes[slot_i] = class_code
+            gap_delta += len(gap_slots(class_codes))
+        return (placed_delta, gap_delta, penalty_delta)
+
+    def _apply(self, plan: list, move_kind: str):
+        for operation in plan:
+            teacher_agent, class_index = operation[1]
+            if operation[0] == "remove":
+                day_i, slot_i = teacher_agent.owned_classes[class_index]["timeslot"]
+                del self.placed[(teacher_agent.get_id(), day_i, slot_i)]
+                self.model.remove_meeting(teacher_agent, class_index)
+            else:
+                day_i, slot_i, room_i = operation[2], operation[3], operation[4]
+                self.model.place_meeting(teacher_agent, class_index, day_i, slot_i, room_i)
+                self.placed[(teacher_agent.get_id(), day_i, slot_i)] = operation[1]
+        self.stats["moves_applied"] += 1
+        self.stats[move_kind] += 1
+
+    def _relocations(self, meeting: tuple):
+        teacher_agent, class_index = meeting
+        owned_class = teacher_agent.owned_classes[class_index]
+        week = owned_class["week"]
+        capable = self._capable(meeting)
+        free_mask = teacher_agent.availability.week_mask(week) & self.model.get_agent(owned_class["group_id"]).availability.week_mask(week)
+        for day_i, slot_i in self.layout.iter_cells(week, free_mask):
+            hostable = capable & self.room_agent.free_rooms[day_i][slot_i]
+            if hostable:
+                yield day_i, slot_i, (hostable & -hostable).bit_length() - 1
+
+    def _displacements(self, meeting: tuple, blocker: tuple, day_i: int, slot_i: int, room_only: bool):
+        capable = self._capable(meeting)
+        blocker_teacher, blocker_class_i = blocker
+        blocker_class = blocker_teacher.owned_classes[blocker_class_i]
+        blocker_group = self.model.get_agent(blocker_class["group_id"])
+        blocker_capable = self._capable(blocker)
+        blocker_room_bit = 1 << self._room_of(blocker)
+        free_rooms = self.room_agent.free_rooms
+        pool = free_rooms[day_i][slot_i]
+        week = blocker_class["week"]
+
+#       The blocker keeps its slot and moves to another room
+        if room_only:
+            room_mask = blocker_capable & pool
+            while room_mask:
+                room_bit = room_mask & -room_mask
+                room_mask ^= room_bit
+                hostable = capable & ((pool & ~room_bit) | blocker_room_bit)
+                if hostable:
+                    yield "room_changes", [
+                        ("remove", blocker),
+                        ("place", blocker, day_i, slot_i, room_bit.bit_length() - 1),
+                        ("place", meeting, day_i, slot_i, (hostable & -hostable).bit_length() - 1)
+                    ]
+
+        hostable = capable & (pool | blocker_room_bit)
+        if not hostable: return
+        room_i = (hostable & -hostable).bit_length() - 1
+
+#       The blocker moves to a slot free for its teacher, its group and one of its rooms
+        for free_day_i, free_slot_i, free_room_i in self._relocations(blocker):
+            yield "relocations", [
+                ("remove", blocker),
+                ("place", blocker, free_day_i, free_slot_i, free_room_i),
+                ("place", meeting, day_i, slot_i, room_i)
+            ]
+
+#       The blocker trades slots with another meeting of its group
+        teacher_agent, class_index = meeting
+        if blocker_group.get_id() == teacher_agent.owned_classes[class_index]["group_id"]: return
+        for other_day_i, other_slot_i in self.layout.iter_cells(week, self.layout.full_week_mask):
+            other = self._meeting_at(blocker_group.timeslots, other_day_i, other_slot_i)
+            if other is None or other == blocker: continue
+            other_teacher = other[0]
+            if other_teacher is blocker_teacher or other_teacher is teacher_agent: continue
+            if not blocker_teacher.availability.is_free(other_day_i, other_slot_i): continue
+            if not other_teacher.availability.is_free(day_i, slot_i): continue
+
+            blocker_hostable = blocker_capable & (free_rooms[other_day_i][other_slot_i] | (1 << self._room_of(other)))
+            if not blocker_hostable: continue
+            other_mask = self._capable(other) & (pool | blocker_room_bit)
+            while other_mask:
+                other_bit = other_mask & -other_mask
+                other_mask ^= other_bit
+                hostable = capable & (pool | blocker_room_bit) & ~other_bit
+                if hostable:
+                    yield "swaps", [
+                        ("remove", blocker),
+                        ("remove", other),
+                        ("place", blocker, other_day_i, other_slot_i, (blocker_hostable & -blocker_hostable).bit_length() - 1),
+                        ("place", other, day_i, slot_i, other_bit.bit_length() - 1),
+                        ("place", meeting, day_i, slot_i, (hostable & -hostable).bit_length() - 1)
+                    ]
+                    break
+
+    def _placements(self, meeting: tuple):
+        teacher_agent, class_index = meeting
+        owned_class = teacher_agent.owned_classes[class_index]
+        group_agent = self.model.get_agent(owned_class["group_id"])
+        capable = self._capable(meeting)
+
+        for day_i, slot_i in self.layout.iter_cells(owned_class["week"], self.layout.full_week_mask):
+            if group_agent.timeslots.class_codes[day_i, slot_i] == BLOCKED_CODE: continue
+            blockers = []
+            for blocker in (self._meeting_at(teacher_agent.timeslots, day_i, slot_i), self._meeting_at(group_agent.timeslots, day_i, slot_i)):
+                if blocker is not None and blocker not in blockers: blockers.append(blocker)
+
+            if len(blockers) > 1:
+                yield from self._double_relocations(meeting, blockers, day_i, slot_i)
+                continue
+            elif blockers:
+                yield from self._displacements(meeting, blockers[0], day_i, slot_i, False)
+                continue
+
+            pool = self.room_agent.free_rooms[day_i][slot_i]
+            if capable & pool:
+                yield "inserts", [("place", meeting, day_i, slot_i, ((capable & pool) & -(capable & pool)).bit_length() - 1)]
+                continue
+
+#           Every capable room is taken, so one of their meetings has to make room
+            room_mask = capable & ~pool
+            while room_mask:
+                room_bit = room_mask & -room_mask
+                room_mask ^= room_bit
+                room_i = room_bit.bit_length() - 1
+                blocker = self.placed.get((self.room_agent.room_teacher(room_i, day_i, slot_i), day_i, slot_i))
+                if blocker is not None:
+                    yield from self._displacements(meeting, blocker, day_i, slot_i, True)
+
+#   Both the teacher's and the group's meetings leave the slot, each to a slot of its own
+    def _double_relocations(self, meeting: tuple, blockers: list, day_i: int, slot_i: int):
+        hostable = self._capable(meeting) & (self.room_agent.free_rooms[day_i][slot_i] | (1 << self._room_of(blockers[0])) | (1 << self._room_of(blockers[1])))
+        if not hostable: return
+        room_i = (hostable & -hostable).bit_length() - 1
+
+        second_relocations = list(self._relocations(blockers[1]))
+        for first_day_i, first_slot_i, first_room_i in self._relocations(blockers[0]):
+            for second_day_i, second_slot_i, second_room_i in second_relocations:
+                if (first_day_i, first_slot_i) == (second_day_i, second_slot_i): continue
+                yield "relocations", [
+                    ("remove", blockers[0]),
+                    ("remove", blockers[1]),
+                    ("place", blockers[0], first_day_i, first_slot_i, first_room_i),
+                    ("place", blockers[1], second_day_i, second_slot_i, second_room_i),
+                    ("place", meeting, day_i, slot_i, room_i)
+                ]
+
+    def _gap_moves(self, group_id: int, day_i: int, slot_i: int):
+        group_agent = self.model.get_agent(group_id)
+        week = self.layout.week_of_day[day_i]
+        pool = self.room_agent.free_rooms[day_i][slot_i]
+
+        for other_day_i, other_slot_i in self.layout.iter_cells(week, self.layout.full_week_mask):
+            meeting = self._meeting_at(group_agent.timeslots, other_day_i, other_slot_i)
+            if meeting is None or not meeting[0].availability.is_free(day_i, slot_i): continue
+            hostable = self._capable(meeting) & pool
+            if hostable:
+                yield "relocations", [("remove", meeting), ("place", meeting, day_i, slot_i, (hostable & -hostable).bit_length() - 1)]
+
+    def _best_move(self, moves, min_score: tuple) -> tuple:
+        best_kind, best_plan, best_score = None, None, min_score
+        for move_kind, plan in moves:
+            if not self._budget_left(): break
+            self.stats["moves_evaluated"] += 1
+            placed_delta, gap_delta, penalty_delta = self._score(plan)
+            score = (-placed_delta, gap_delta, penalty_delta)
+            if score < best_score:
+                best_kind, best_plan, best_score = move_kind, plan, score
+        return best_kind, best_plan, best_score
+
+    def _start_repair(self):
+        for group_id in self.group_ids:
+            response = self.request(Message(MessageType.WHEREGAPS, None), group_id)
+            if response.get_type() != MessageType.USERGAPS:
+                raise Exception(f"USERGAPS expected. Got {response.get_type()}")
+            self.group_gaps[group_id] = response.get_content()
+            self.gaps.extend((group_id, day_i, slot_i) for day_i, slot_i in response.get_content())
+
+        for teacher_id in self.teacher_ids:
+            teacher_agent = self.model.get_agent(teacher_id)
+            for class_index, owned_class in enumerate(teacher_agent.owned_classes):
+                if owned_class["timeslot"] is not None:
+                    self.placed[(teacher_id, *owned_class["timeslot"])] = (teacher_agent, class_index)
+
+            response = self.request(Message(MessageType.SET_STATE, TeacherState.TALK_TO_DEANERY), teacher_id)
+            if response.get_type() != MessageType.ACCEPT:
+                raise Exception(f"ACCEPT expected. Got {response.get_type()}")
+            self.talking_teachers.append(teacher_id)
+            for class_index in response.get_content():
+#               Classes no room could ever host are left as they are
+                if self._capable((teacher_agent, class_index)):
+                    self.failed.append((teacher_agent, class_index))
+
+        self.stats["failed_before"] = len(self.failed)
+        self.stats["gaps_before"] = len(self.gaps)
+        self.stats["gaps_after"] = len(self.gaps)
+        self.model.trace.info("Deanery repairs {} failed classes and {} gaps", len(self.failed), len(self.gaps))
+
+    def _finish_repair(self):
+        for teacher_id in self.talking_teachers:
+            self.send_message(Message(MessageType.SET_STATE, TeacherState.WORK_ENDED), teacher_id)
+        self.talking_teachers = []
+        self.stats["time"] += time.perf_counter() - self.start_time
+        self.state = DeaneryState.WORK_ENDED
+        self.model.trace.info("Deanery repaired {} of {} failed classes, gaps: {} -> {}",
+            self.stats["repaired"], self.stats["failed_before"], self.stats["gaps_before"], self.stats["gaps_after"])
+
+#   Moves are applied whole within a step, so stopping between steps leaves a consistent schedule
+    def stop(self):
+        if self.state == DeaneryState.FIND_FREE_TEACHERS:
+            self._finish_repair()
+        else:
+            self.state = DeaneryState.WORK_ENDED
+
     def step(self):
         if self.state == DeaneryState.WAIT_FOR_TEACHERS:
-            if self.completed_teachers_count != len(self.teacher_ids): return 
-            
-            no_gaps_found = True
-            for group_id in self.group_ids:
-                request = Message(MessageType.WHEREGAPS, None)
-                request.set_sender(self.get_id())
-                request.set_receiver(group_id)
-
-                response = self.pop_last_message()
-                if response.get_type() == MessageType.USERGAPS:
-                    self.group_gaps[response.get_sender()] = response.get_content()
-                    if len(response.get_content()): no_gaps_found = False
-                else:
-                    raise Exception(f"USERGAPS expected. Got {response.get_type()}")
-        
-            if no_gaps_found:
-                for teacher_id in self.teacher_ids:
-                    message = Message(
-                        MessageType.SET_STATE, 
-                        TeacherState.WORK_ENDED,
-                        self.get_id(), teacher_id)
-                    self.send_message(message, teacher_id)
-                self.state = DeaneryState.WORK_ENDED
-            else:
-                for teacher_id, in self.teacher_ids:
-                    message = Message(
-                        MessageType.SET_STATE, 
-                        TeacherState.TALK_TO_DEANERY,
-                        self.get_id(), teacher_id)
-                    self.send_message(message, teacher_id)
-                self.state = DeaneryState.FIND_FREE_TEACHERS
-        
-        elif self.state == DeaneryState.FIND_FREE_TEACHERS:
-            max_free_times = 0
-            for teacher_id in self.teacher_ids:
-                request = Message(MessageType.TIMEPROPOSAL, self.group_gaps, self.get_id(), teacher_id)
-                self.send_message(request, teacher_id)
+            if self.model.finished_teacher_count != self.model.teacher_count: return
+            self.start_time = time.perf_counter()
+            self.room_agent = self.model.get_agent(self.model.room_agent_id)
+            self.layout = self.model.slot_layout
+            self.state = DeaneryState.ASK_GAPS
 
-                response = self.pop_last_message()
-                if response.get_type() == MessageType.ACCEPT:
-                    pass
+        if self.state == DeaneryState.ASK_GAPS:
+            self._start_repair()
+            self.state = DeaneryState.FIND_FREE_TEACHERS
 
-    def on_receive(self): pass
+#       One failed class or one gap is handled per step
+        elif self.state == DeaneryState.FIND_FREE_TEACHERS:
+            self.stats["steps"] += 1
+            if self.failed:
+                meeting = self.failed.popleft()
+                move_kind, plan, score = self._best_move(self._placements(meeting), (0, 0, 0.0))
+                if plan is not None:
+                    self._apply(plan, move_kind)
+                    self.stats["repaired"] += 1
+                    self.stats["gaps_after"] += score[1]
+
+            elif self.gaps:
+                group_id, day_i, slot_i = self.gaps.popleft()
+                group_agent = self.model.get_agent(group_id)
+                if slot_i in gap_slots(group_agent.timeslots.class_codes[day_i].tolist()):
+                    move_kind, plan, score = self._best_move(self._gap_moves(group_id, day_i, slot_i), (0, 0, 0.0))
+                    if plan is not None and score[1] < 0:
+                        self._apply(plan, move_kind)
+                        self.stats["gaps_after"] += score[1]
+
+        if self.state == DeaneryState.FIND_FREE_TEACHERS and (not (self.failed or self.gaps) or not self._budget_left()):
+            self._finish_repair()
 
 class ScheduleModel(Model):
-    def _make_ids(self, group_config: dict, global_space: Space) -> int:
+    def _make_ids(self, group_config: dict, timepref_config: dict, global_space: Space) -> int:
         for group_name, group_plan in group_config.items():
-            group_id = global_space.match(group_name)
+            group_id = global_space.match(group_name, EntityKind.GROUP)
             self.group_ids.append(group_id)
+            self.group_timeprefs[group_id] = timepref_config.get(group_name)
 
             self.group_times[group_id] = [0,] * self.parity_rank
             for class_name, class_info in group_plan.items():
                 for i in range(len(class_info["times"])):
                     self.group_times[group_id][i] += class_info["times"][i]
             
-            self.log_message(f"Times of group {group_id}: {self.group_times[group_id]}")
+            self.trace.debug("Times of group {}: {}", group_id, self.group_times[group_id])
 
             for class_name, class_info in group_plan.items():
                 _class = ClassInfo(class_name, class_info, group_id, global_space)
                 self.class_ids.append(_class.id)
 
-                teacher_id = global_space.match(class_info["teacher"])
-                self.log_message(f"{class_name} [{_class.id}] owned by {class_info['teacher']} [{teacher_id}]")
+                teacher_id = global_space.match(class_info["teacher"], EntityKind.TEACHER)
+                self.trace.debug("{} [{}] owned by {} [{}]", class_name, _class.id, class_info["teacher"], teacher_id)
                 if not (teacher_id in self.teacher_ids):
                     self.teacher_ids[teacher_id] = {}
                 
-                for i, time in enumerate(class_info["times"]):
-                    _class_copy = copy.deepcopy(_class)
-                    _class_copy.times = (i, time)
+                for i, class_time in enumerate(class_info["times"]):
+                    _class_copy = copy.copy(_class)
+                    _class_copy.times = (i, class_time)
 
 #                   owned_class: tuple (id, group id, appearance, tools)
 #                   appearance: tuple (week number, count of class repeats (it's called "time"))
 #                   tools: tuple (tool1, tool2, ..., tooln)
 
                     if "owned_classes" in self.teacher_ids[teacher_id]:
-                        self.teacher_ids[teacher_id]["owned_classes"].add(_class_copy)
+                        self.teacher_ids[teacher_id]["owned_classes"].append(_class_copy)
                     else:
-                        self.teacher_ids[teacher_id]["owned_classes"] = {_class_copy}
+                        self.teacher_ids[teacher_id]["owned_classes"] = [_class_copy]
 
                 if "owned_groups" in self.teacher_ids[teacher_id]:
                     self.teacher_ids[teacher_id]["owned_groups"].add(group_id)
                 else:
                     self.teacher_ids[teacher_id]["owned_groups"] = {group_id}
         
-        self.log_message(f"Group ids: {self.group_ids}")
-        self.log_message(f"Class ids: {self.class_ids}")
-        self.log_message(f"Teacher ids: {self.teacher_ids}")
-        return global_space.match("This slot is blocked for capturing!")
-
-    def _make_timeslots(self, group_id: int, slot_blocked_id: int):
+        self.trace.info("Group ids: {}", self.group_ids)
+        self.trace.info("Class count: {}, teacher count: {}", len(self.class_ids), len(self.teacher_ids))
+        if self.trace.debug_enabled:
+            self.trace.debug("Class ids: {}", self.class_ids)
+            self.trace.debug("Teacher ids: {}", list(self.teacher_ids))
+        return global_space.match("This slot is blocked for capturing!", EntityKind.SERVICE)
+
+    def _make_timeslots(self, group_id: int) -> TimeslotView:
         class_min_count = self.default_timeslots["class_min_count"]
-        new_timeslots = copy.deepcopy(self.default_timeslots["timeslots"])
-        slot_per_day = len(new_timeslots[0])
-        day_count = len(new_timeslots)
-        day_per_week = day_count // self.parity_rank
+        new_timeslots = self.timeslot_store.view(group_id)
+        slot_per_day = self.slot_layout.slot_count
+        day_per_week = self.slot_layout.day_per_week
         #day_checklist = [slot_per_day - 1,] * len(new_timeslots)
 
         for time_i in range(len(self.group_times[group_id])):
@@ -598,17 +1164,26 @@ class ScheduleModel(Model):
                 if free_slot_count <= 0: break
 
                 while slot_to_block >= class_min_count:
-                    new_timeslots[day_i][slot_to_block] = slot_blocked_id
+                    new_timeslots.block(day_i, slot_to_block)
                     slot_to_block -= 1
                     free_slot_count -= 1
                     if not free_slot_count: break
 
         return new_timeslots
 
-    def _make_groups_and_teachers(self, default_timeslots: list, slot_blocked_id: int):
+#   The change journal only serves live viewers, solving runs don't pay for it
+    def _journal_capacity(self, debug_config: dict) -> int:
+        if not debug_config.get("journal", False): return 0
+        return debug_config.get("journal_capacity", 100000)
+
+    def _make_groups_and_teachers(self):
         for group_id in self.group_ids:
-            group_agent_set = GroupAgent.create_agents(self, 1, group_id, self._make_timeslots(group_id, slot_blocked_id))
-            self.sending_agents.append(next(iter(group_agent_set)))
+            group_agent_set = GroupAgent.create_agents(self, 1,
+                group_id,
+                self._make_timeslots(group_id),
+                self.group_timeprefs[group_id]
+            )
+            self.add_sending_agent(next(iter(group_agent_set)))
 
         for teacher_id, teacher_property in self.teacher_ids.items():
             if not len(teacher_property["owned_classes"]) or not len(teacher_property["owned_groups"]):
@@ -616,68 +1191,186 @@ class ScheduleModel(Model):
 
             teacher_agent_set = TeacherAgent.create_agents(self, 1,
                 teacher_id,
-                copy.deepcopy(default_timeslots),
+                self.timeslot_store.view(teacher_id),
                 list(teacher_property["owned_classes"]),
                 list(teacher_property["owned_groups"])
             )
-            self.sending_agents.append(next(iter(teacher_agent_set)))
-
-    def __init__(self, default_timeslots, parity_rank: int, config: dict, global_space: Space):
-        super().__init__(seed=0)
-        random.seed(0)
+            teacher_agent = next(iter(teacher_agent_set))
+            self.add_sending_agent(teacher_agent)
+#           Every teacher is new here, so it joins without activate_agent's membership scan
+            self.active_agents.append(teacher_agent)
+            self.teacher_count += 1
+
+    def __init__(self, default_timeslots, parity_rank: int, config: dict, global_space: Space, seed: int = 0):
+        super().__init__(seed=seed)
+        random.seed(seed)
         self.agents # !!!
 
+        self.seed = seed
+        self.global_space = global_space
         self.default_timeslots = default_timeslots
         self.group_ids = []
         self.class_ids = []
         self.room_ids = []
         self.teacher_ids = {}
         self.sending_agents = []
-        self.message_log = []
+        self.agent_directory = {}
+        self.active_agents = []
+        self.pending_receivers = deque()
+        self.delivering = False
+        self.routed_count = 0
+        self.last_step_routed_count = 0
+        self.max_pending_count = 0
+        self.trace = EventTrace(**config.get("trace_config", {}))
+        self.profile = SolverProfile(**config.get("profile_config", {}))
+        self.solver_config = config.get("solver_config", {})
+        self.fused_negotiation = self.solver_config.get("fused_negotiation", False)
         self.parity_rank = parity_rank
         self.group_times = {}
+        self.group_timeprefs = {}
+        self.teacher_count = 0
+        self.finished_teacher_count = 0
+        self.owned_class_total = 0
+        self.solution_counts = {solution_type: 0 for solution_type in SolutionType}
+        self.preference_penalty = 0.0
+        self.deanery = None
+        self.warm_start_stats = None
+        self.stopped = None
+        self.slot_layout = SlotLayout(
+            len(default_timeslots["timeslots"]),
+            len(default_timeslots["timeslots"][0]),
+            parity_rank)
+
+        self.room_agent_id = global_space.match("Room agent", EntityKind.SERVICE)
+        self.slot_blocked_id = self._make_ids(config["group_config"], config.get("timepref_config", {}), global_space)
+        self.room_ids = global_space.match_many(config["room_config"], EntityKind.ROOM)
+
+#       One occupancy tensor for every group, teacher and room, agents only get views into it
+        self.timeslot_store = TimeslotStore(
+            self.group_ids + list(self.teacher_ids) + self.room_ids,
+            self.slot_layout.day_count,
+            self.slot_layout.slot_count,
+            self._journal_capacity(config.get("debug_config", {})))
 
-        self.room_agent_id = global_space.match("Room agent")
         room_agent_set = RoomAgent.create_agents(self, 1, 
             self.room_agent_id,
-            self.default_timeslots["timeslots"],
             config["room_config"],
             global_space)
         
-        room_agent = next(iter(room_agent_set))
-        self.sending_agents.append(room_agent)
-
-        slot_blocked_id = self._make_ids(config["group_config"], global_space)
-        self._make_groups_and_teachers(self.default_timeslots["timeslots"], slot_blocked_id)
+        self.room_agent = next(iter(room_agent_set))
+        self.add_sending_agent(self.room_agent)
+        self._make_groups_and_teachers()
+        if config.get("warm_start") is not None:
+            self._apply_warm_start(config["warm_start"])
+        if config.get("solver_config", {}).get("skip_infeasible", False):
+            self._skip_infeasible_classes()
+        self.skip_resolved_classes()
+
+        repair_config = config.get("solver_config", {}).get("repair", {})
+        if repair_config.get("enabled", False):
+            deanery_set = DeaneryAgent.create_agents(self, 1,
+                global_space.match("Deanery", EntityKind.SERVICE),
+                list(self.teacher_ids),
+                self.group_ids,
+                repair_config)
+            self.deanery = next(iter(deanery_set))
+            self.add_sending_agent(self.deanery)
     
     def step(self):
-        self.agents.shuffle_do("step")
+        self.trace.step = self.steps
+        self.timeslot_store.step = self.steps
+        routed_before = self.routed_count
+
+#       Only agents with pending work are stepped. They are kept in creation order and shuffled
+#       with the model's seeded generator, so the activation order is reproducible
+        activation_order = list(self.active_agents)
+        self.random.shuffle(activation_order)
+        for agent in activation_order:
+            agent.step()
+        self.deliver_messages()
+        self.active_agents = [agent for agent in self.active_agents if agent.is_active()]
+#       The deanery joins only once construction is over, so it doesn't change the activation order before that
+        if self.deanery is not None and self.deanery.state == DeaneryState.WAIT_FOR_TEACHERS and self.finished_teacher_count == self.teacher_count:
+            self.activate_agent(self.deanery)
+        self.last_step_routed_count = self.routed_count - routed_before
+
+    def post_message(self, agent: SendingAgent, message: Message):
+        if not agent.message_box:
+            self.pending_receivers.append(agent)
+            if len(self.pending_receivers) > self.max_pending_count:
+                self.max_pending_count = len(self.pending_receivers)
+        agent.receive_message(message)
+
+#   Handlers only queue their replies, so delivery is a flat loop instead of nested on_receive calls
+    def deliver_messages(self):
+        if self.delivering: return
+        self.delivering = True
+        try:
+            while self.pending_receivers:
+                self.routed_count += self.pending_receivers.popleft().process_messages()
+        finally:
+            self.delivering = False
+
+    def get_message_stats(self) -> dict:
+        return {
+            "routed": self.routed_count,
+            "routed_last_step": self.last_step_routed_count,
+            "routed_per_step": self.routed_count / self.steps if self.steps else 0.0,
+            "max_pending_receivers": self.max_pending_count
+        }
+
+    def add_sending_agent(self, agent: SendingAgent):
+        if agent.get_id() in self.agent_directory:
+            raise Exception(f"Agent [{agent.get_id()}] is already registered!")
+
+        self.sending_agents.append(agent)
+        self.agent_directory[agent.get_id()] = agent
+
+    def activate_agent(self, agent: SendingAgent):
+        if agent not in self.active_agents:
+            self.active_agents.append(agent)
+
+    def get_agent(self, agent_id: int) -> SendingAgent:
+        return self.agent_directory.get(agent_id)
+
+    def get_agent_ids(self, kind: EntityKind = None) -> list:
+        if kind is None: return list(self.agent_directory)
+        return [agent_id for agent_id in self.agent_directory if self.global_space.is_kind(agent_id, kind)]
     
     def get_group_timeslots(self):
         timeslots = {}
         for agent in self.sending_agents:
-            if isinstance(agent, GroupAgent):
+            if self.global_space.is_kind(agent.get_id(), EntityKind.GROUP):
                 timeslots[agent.get_id()] = agent.get_timeslots()
         return timeslots
     
+    def get_cell_changes(self, since_step: int) -> list:
+        return self.timeslot_store.changes_since(since_step)
+
     def get_teacher_states(self):
         states = []
         for agent in self.sending_agents:
-            if isinstance(agent, TeacherAgent):
+            if self.global_space.is_kind(agent.get_id(), EntityKind.TEACHER):
                 states.append(agent.state)
         return states
     
+    def get_timeslot_store(self) -> TimeslotStore:
+        return self.timeslot_store
+
+    def group_meeting_count(self) -> int:
+        return self.timeslot_store.meeting_count(self.group_ids)
+
     def get_room_timeslots(self) -> dict:
         for agent in self.sending_agents:
-            if isinstance(agent, RoomAgent):
+            if agent.get_id() == self.room_agent_id:
                 room_timeslots = agent.get_room_timeslots()
                 return room_timeslots
 
-    def log_message(self, log_part: str):
-        self.message_log.append(log_part)
+    def log_message(self, log_part: str, level: TraceLevel = TraceLevel.INFO):
+        self.trace.log(level, log_part)
 
-    def get_message_log(self):
-        return self.message_log
+    def get_message_log(self) -> list:
+        return self.trace.get_lines()
 
     def get_parity_rank(self):
         return self.parity_rank
@@ -690,32 +1383,145 @@ class ScheduleModel(Model):
         return True
     
     def schedule_ready(self) -> bool:
-        return self.schedule_in_state(TeacherState.WORK_ENDED)
+        if self.finished_teacher_count != self.teacher_count: return False
+        return self.deanery is None or not self.deanery.is_active()
+
+    def count_owned_classes(self, class_count: int):
+        self.owned_class_total += class_count
+        self.solution_counts[SolutionType.UNDEFINED] += class_count
+
+    def count_solution(self, previous_solution: SolutionType, solution: SolutionType):
+        self.solution_counts[previous_solution] -= 1
+        self.solution_counts[solution] += 1
+
+#   Same measure groups rank their cells by: the preference a placed class gives up, weighted by its priority
+    def count_placement(self, owned_class: dict, timeslot: tuple, sign: int = 1):
+        group_agent = self.get_agent(owned_class["group_id"])
+        self.preference_penalty += sign * group_agent.placement_cost(timeslot[0], timeslot[1], owned_class["priority"])
+
+#   Direct edits of the schedule for the repair phase, they keep every view, mask and counter in step
+    def place_meeting(self, teacher_agent: TeacherAgent, class_index: int, day_i: int, slot_i: int, room_i: int):
+        owned_class = teacher_agent.owned_classes[class_index]
+        room_agent = self.get_agent(self.room_agent_id)
+        room_id = room_agent.owned_rooms[room_i].id
+
+        room_agent.occupy_room(room_i, owned_class["id"], teacher_agent.get_id(), day_i, slot_i)
+        self.get_agent(owned_class["group_id"]).fix_meeting(day_i, slot_i, owned_class["id"], teacher_agent.get_id(), room_id)
+        teacher_agent.fix_class(class_index, day_i, slot_i, room_id)
+
+    def remove_meeting(self, teacher_agent: TeacherAgent, class_index: int):
+        owned_class = teacher_agent.owned_classes[class_index]
+        day_i, slot_i = owned_class["timeslot"]
+        room_agent = self.get_agent(self.room_agent_id)
+        room_i = room_agent.room_index[int(teacher_agent.timeslots.room_codes[day_i, slot_i])]
+
+        room_agent.release_room(room_i, day_i, slot_i)
+        self.get_agent(owned_class["group_id"]).cancel_meeting(day_i, slot_i)
+        teacher_agent.release_class(class_index)
+
+    def _warm_start_meeting(self, meeting: dict) -> str:
+        space = self.global_space
+        group_id = space.find(meeting["group"], EntityKind.GROUP)
+        class_id = space.find(meeting["class"], EntityKind.CLASS)
+        teacher_id = space.find(meeting["teacher"], EntityKind.TEACHER)
+        room_id = space.find(meeting["room"], EntityKind.ROOM)
+        if group_id is None or self.get_agent(group_id) is None: return "unknown_group"
+        if class_id is None or teacher_id is None or self.get_agent(teacher_id) is None: return "unknown_class"
+        if room_id is None or room_id not in self.room_agent.room_index: return "unknown_room"
+
+        day_i, slot_i = meeting["day"], meeting["slot"]
+        if not (0 <= day_i < self.slot_layout.day_count and 0 <= slot_i < self.slot_layout.slot_count): return "outside_grid"
+        week = self.slot_layout.week_of_day[day_i]
+
+#       The class has to be still owned by the same teacher for the same group, and still need a meeting that week
+        teacher_agent = self.get_agent(teacher_id)
+        class_index = next((
+            class_i for class_i, owned_class in enumerate(teacher_agent.owned_classes)
+            if owned_class["id"] == class_id and owned_class["group_id"] == group_id
+                and owned_class["week"] == week and owned_class["timeslot"] is None
+        ), None)
+        if class_index is None: return "not_needed"
+
+        owned_class = teacher_agent.owned_classes[class_index]
+        room_i = self.room_agent.room_index[room_id]
+        if not (self.room_agent.capable_rooms(owned_class["type_id"], owned_class["tools"]) >> room_i) & 1: return "room_unsuitable"
+        if not self.get_agent(group_id).availability.is_free(day_i, slot_i): return "group_busy"
+        if not teacher_agent.availability.is_free(day_i, slot_i): return "teacher_busy"
+        if not (self.room_agent.free_rooms[day_i][slot_i] >> room_i) & 1: return "room_busy"
+
+        self.place_meeting(teacher_agent, class_index, day_i, slot_i, room_i)
+        return "kept"
+
+    def _apply_warm_start(self, meetings: list):
+        self.warm_start_stats = {"meetings": len(meetings)}
+        for meeting in meetings:
+            outcome = self._warm_start_meeting(meeting)
+            self.warm_start_stats[outcome] = self.warm_start_stats.get(outcome, 0) + 1
+
+        self.trace.info("Warm start kept {} of {} meetings", self.warm_start_stats.get("kept", 0), len(meetings))
+
+#   Same test as the room agent's NEVER reject, made before any negotiation round is spent on the class
+    def _skip_infeasible_classes(self):
+        skipped_count = 0
+        for teacher_id in self.teacher_ids:
+            teacher_agent = self.get_agent(teacher_id)
+            for class_index, owned_class in enumerate(teacher_agent.owned_classes):
+                if owned_class["solution"] != SolutionType.UNDEFINED: continue
+                if not self.room_agent.capable_rooms(owned_class["type_id"], owned_class["tools"]):
+                    teacher_agent.skip_class(class_index)
+                    skipped_count += 1
+        self.trace.info("Skipped {} classes no room can host", skipped_count)
+
+    def skip_resolved_classes(self):
+#       Teachers with nothing left to negotiate are done before the first step
+        for teacher_id in self.teacher_ids:
+            self.get_agent(teacher_id).skip_resolved_classes()
+        self.active_agents = [agent for agent in self.active_agents if agent.is_active()]
+
+#   Ends solving between two steps, what is placed so far is the result
+    def stop_negotiation(self, reason: str) -> int:
+        self.stopped = reason
+        abandoned_count = 0
+        for teacher_id in self.teacher_ids:
+            abandoned_count += self.get_agent(teacher_id).abandon()
+        if self.deanery is not None:
+            self.deanery.stop()
+        self.deliver_messages()
+        self.active_agents = [agent for agent in self.active_agents if agent.is_active()]
+        return abandoned_count
+
+    def get_profile(self) -> SolverProfile:
+        return self.profile
+
+    def get_warm_start_stats(self) -> dict:
+        return self.warm_start_stats
+
+    def get_repair_stats(self) -> dict:
+        if self.deanery is None: return None
+        return self.deanery.stats
 
     def failed_count(self) -> int:
-        fail_count = 0
-        for agent in self.sending_agents:
-            if isinstance(agent, TeacherAgent):
-                fail_count += agent.count_solutions_of_type(SolutionType.SOLUTION_NOT_FOUND)
-        return fail_count
+        return self.solution_counts[SolutionType.SOLUTION_NOT_FOUND]
     
     def completed_count(self) -> int:
-        completion_count = 0
-        for agent in self.sending_agents:
-            if isinstance(agent, TeacherAgent):
-                completion_count += agent.count_solutions_of_type(SolutionType.SOLUTION_FOUND)
-        return completion_count
+        return self.solution_counts[SolutionType.SOLUTION_FOUND]
 
     def undefined_count(self) -> int:
-        count = 0
-        for agent in self.sending_agents:
-            if isinstance(agent, TeacherAgent):
-                count += agent.count_solutions_of_type(SolutionType.UNDEFINED)
-        return count
+        return self.solution_counts[SolutionType.UNDEFINED]
 
     def owned_class_count(self) -> int:
-        count = 0
-        for agent in self.sending_agents:
-            if isinstance(agent, TeacherAgent):
-                count += agent.count_owned_classes()
-        return count
\ No newline at end of file
+        return self.owned_class_total
+
+    def get_progress(self) -> dict:
+        resolved_count = self.owned_class_total - self.undefined_count()
+        return {
+            "step": self.steps,
+            "teachers": self.teacher_count,
+            "finished_teachers": self.finished_teacher_count,
+            "owned": self.owned_class_total,
+            "completed": self.completed_count(),
+            "failed": self.failed_count(),
+            "undefined": self.undefined_count(),
+            "preference_penalty": self.preference_penalty,
+            "resolved_percent": (resolved_count / self.owned_class_total) * 100 if self.owned_class_total else 100.0
+        }
\ No newline at end of file
@@ -0,0 +1,156 @@
+import argparse
+import copy
+import sys
+from entity_system import Space
+from schedudle_model import ScheduleModel, SolutionType, TeacherState
+from schedule_runner import make_schedule_model, make_decoder, build_schedule
+from timeslot_store import FREE_CODE
+from availability import AvailabilityMask
+from warm_start import timetable_meetings
+from instance_generator import INSTANCE_SIZES, load_instance, load_bundled_instance
+
+#   Cross-checks everything the solver keeps in step by hand: the group, teacher and room rows of the store,
+#   the availability masks, the room agent's free_rooms and the model's counters. Meant for a model at rest,
+#   after solving or after a stop, when no meeting is half reserved. Returns the problems found
+def check_schedule(schedule_model: ScheduleModel) -> list:
+    problems = []
+    room_agent = schedule_model.room_agent
+    layout = schedule_model.slot_layout
+
+    rooms = {room.id: (room_i, room) for room_i, room in enumerate(room_agent.owned_rooms)}
+    group_cells = {}
+    for group_id in schedule_model.group_ids:
+        timeslots = schedule_model.get_agent(group_id).timeslots
+        for day_i in range(layout.day_count):
+            for slot_i in range(layout.slot_count):
+                if timeslots.is_meeting(day_i, slot_i):
+                    group_cells[(group_id, day_i, slot_i)] = timeslots.get_meeting(day_i, slot_i)
+
+    solution_counts = {solution_type: 0 for solution_type in SolutionType}
+    owned_count = 0
+    finished_count = 0
+    preference_penalty = 0.0
+    placed = set()
+    for teacher_id in schedule_model.teacher_ids:
+        teacher_agent = schedule_model.get_agent(teacher_id)
+        if teacher_agent.state == TeacherState.WORK_ENDED: finished_count += 1
+        for class_index, owned_class in enumerate(teacher_agent.owned_classes):
+            owned_count += 1
+            solution_counts[owned_class["solution"]] += 1
+            name = f"Class {class_index} of teacher {teacher_id}"
+            if owned_class["solution"] == SolutionType.UNDEFINED:
+                problems.append(f"{name} is still undefined")
+            if (owned_class["timeslot"] is not None) != (owned_class["solution"] == SolutionType.SOLUTION_FOUND):
+                problems.append(f"{name} is {owned_class['solution'].name} with timeslot {owned_class['timeslot']}")
+            if owned_class["timeslot"] is None: continue
+
+            day_i, slot_i = owned_class["timeslot"]
+            if layout.week_of_day[day_i] != owned_class["week"]:
+                problems.append(f"{name} of week {owned_class['week']} is placed on day {day_i}")
+            class_id, row_teacher_id, room_id = teacher_agent.timeslots.get_meeting(day_i, slot_i)
+            if (class_id, row_teacher_id) != (owned_class["id"], teacher_id) or room_id not in rooms:
+                problems.append(f"{name} at [{day_i}][{slot_i}] has teacher row {(class_id, row_teacher_id, room_id)}")
+                continue
+            if group_cells.get((owned_class["group_id"], day_i, slot_i)) != (class_id, teacher_id, room_id):
+                problems.append(f"{name} at [{day_i}][{slot_i}] has group row {group_cells.get((owned_class['group_id'], day_i, slot_i))}")
+            room_i, room = rooms[room_id]
+            if room.timeslots.get_meeting(day_i, slot_i) != (class_id, teacher_id, room_id):
+                problems.append(f"{name} at [{day_i}][{slot_i}] has room row {room.timeslots.get_meeting(day_i, slot_i)}")
+            if not (room_agent.capable_rooms(owned_class["type_id"], owned_class["tools"]) >> room_i) & 1:
+                problems.append(f"{name} at [{day_i}][{slot_i}] is in room {room_id}, which can't host it")
+            placed.add((owned_class["group_id"], day_i, slot_i))
+            preference_penalty += schedule_model.get_agent(owned_class["group_id"]).placement_cost(day_i, slot_i, owned_class["priority"])
+
+#   Every meeting in a row has to belong to a placed class
+    for group_id, day_i, slot_i in set(group_cells) - placed:
+        problems.append(f"Group {group_id} has a meeting at [{day_i}][{slot_i}] no teacher placed")
+    teacher_rows = [schedule_model.get_agent(teacher_id).timeslots for teacher_id in schedule_model.teacher_ids]
+    room_rows = [room.timeslots for room in room_agent.owned_rooms]
+    teacher_meetings = sum(timeslots.meeting_count() for timeslots in teacher_rows)
+    room_meetings = sum(timeslots.meeting_count() for timeslots in room_rows)
+    if not teacher_meetings == room_meetings == len(placed):
+        problems.append(f"Placed {len(placed)} classes, teacher rows hold {teacher_meetings} meetings, room rows {room_meetings}")
+
+    agents = [schedule_model.get_agent(group_id) for group_id in schedule_model.group_ids]
+    agents += [schedule_model.get_agent(teacher_id) for teacher_id in schedule_model.teacher_ids]
+    for agent in agents + room_agent.owned_rooms:
+        if agent.availability.week_masks != AvailabilityMask(layout, agent.timeslots.free_flags()).week_masks:
+            problems.append(f"Availability mask of {agent.timeslots.entity_id} doesn't match its row")
+
+    for day_i in range(layout.day_count):
+        for slot_i in range(layout.slot_count):
+            free_rooms = sum(1 << room_i for room_i, room in enumerate(room_agent.owned_rooms) if room.timeslots.class_codes[day_i, slot_i] == FREE_CODE)
+            if room_agent.free_rooms[day_i][slot_i] != free_rooms:
+                problems.append(f"free_rooms[{day_i}][{slot_i}] is {room_agent.free_rooms[day_i][slot_i]:b}, rows say {free_rooms:b}")
+
+    if solution_counts != schedule_model.solution_counts:
+        problems.append(f"Solution counters are {schedule_model.solution_counts}, classes say {solution_counts}")
+    if owned_count != schedule_model.owned_class_count():
+        problems.append(f"Owned class counter is {schedule_model.owned_class_count()}, teachers own {owned_count}")
+    if finished_count != schedule_model.finished_teacher_count:
+        problems.append(f"Finished teacher counter is {schedule_model.finished_teacher_count}, {finished_count} teachers ended work")
+    if abs(preference_penalty - schedule_model.preference_penalty) > 1e-6 * max(1.0, preference_penalty):
+        problems.append(f"Preference penalty is {schedule_model.preference_penalty}, placed classes add up to {preference_penalty}")
+    if schedule_model.group_meeting_count() != len(placed):
+        problems.append(f"Group rows hold {schedule_model.group_meeting_count()} meetings, {len(placed)} classes are placed")
+    return problems
+
+def solve(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict, solver_changes: dict, warm_start: list = None) -> tuple:
+    run_config = copy.deepcopy(main_config)
+    run_config.setdefault("solver", {}).update(solver_changes)
+    global_space = Space()
+    schedule_model = make_schedule_model(run_config, group_config, room_config, timepref_config, global_space, warm_start=warm_start)
+    iterations = build_schedule(schedule_model, verbose=False)
+    return schedule_model, global_space, iterations
+
+#   Every way a schedule can be finished: plain negotiation with repair, fused negotiation, the exact search (also cut short),
+#   negotiation stopped at several step counts (abandon and stop_negotiation), and a warm start into a changed config
+def check_instance(instance_name: str, solver_config: dict) -> list:
+    main_config, group_config, room_config, timepref_config = load_instance(instance_name)
+    main_config["solver"] = copy.deepcopy(solver_config)
+    runs = []
+
+    schedule_model, global_space, iterations = solve(main_config, group_config, room_config, timepref_config, {})
+    runs.append(("stepwise", schedule_model))
+    runs.append(("fused", solve(main_config, group_config, room_config, timepref_config, {"fused_negotiation": True})[0]))
+    runs.append(("exact", solve(main_config, group_config, room_config, timepref_config, {"engine": "exact", "exact": {"time_limit": 2.0}})[0]))
+#   A node limit this small stops the search before its first complete assignment
+    runs.append(("exact/node_limit=10", solve(main_config, group_config, room_config, timepref_config, {"engine": "exact", "exact": {"node_limit": 10}})[0]))
+
+    for fraction in (0.1, 0.5, 0.9, 0.99):
+        step_limit = max(1, int(iterations * fraction))
+        runs.append((f"step_limit={step_limit}", solve(main_config, group_config, room_config, timepref_config, {"budget": {"step_limit": step_limit}})[0]))
+
+#   The previous timetable is warm started into a config with one room fewer, so some of its meetings get dropped
+    timetable = make_decoder(main_config, schedule_model, global_space).decode()
+    changed_room_config = dict(list(room_config.items())[1:])
+    warm_start = timetable_meetings(main_config, timetable)
+    runs.append(("warm_start", solve(main_config, group_config, changed_room_config, timepref_config, {}, warm_start)[0]))
+    runs.append(("warm_start/step_limit=1", solve(main_config, group_config, changed_room_config, timepref_config, {"budget": {"step_limit": 1}}, warm_start)[0]))
+
+    problems = []
+    for run_name, run_model in runs:
+        run_problems = check_schedule(run_model)
+        print(f"{instance_name}/{run_name:<24} completed: {run_model.completed_count()}/{run_model.owned_class_count()}  "
+              f"stopped: {run_model.stopped}  problems: {len(run_problems)}")
+        problems.extend(f"{instance_name}/{run_name}: {problem}" for problem in run_problems)
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Solves instances in every supported way and checks that the schedule state stays consistent")
+    parser.add_argument("--instances", nargs="+", default=["bundled", "small", "medium"], choices=["bundled", *INSTANCE_SIZES])
+    args = parser.parse_args()
+
+    solver_config = load_bundled_instance()[0].get("solver", {})
+
+    problems = []
+    for instance_name in args.instances:
+        problems.extend(check_instance(instance_name, solver_config))
+    for problem in problems:
+        print(f"PROBLEM {problem}")
+    if problems:
+        sys.exit(1)
+    print("Schedule state is consistent")
+
+if __name__ == "__main__":
+    main()
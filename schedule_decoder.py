@@ -1,39 +1,148 @@
+import copy
+import numpy as np
 from entity_system import Space, IdDecoder
+from timeslot_store import TimeslotStore, FREE_CODE, BLOCKED_CODE
 
-class ScheduleDecoder(IdDecoder):
-    def __init__(self, main_config, global_space: Space, timeslots):
+#   Views by owner: which id of a meeting owns the row, and which two are shown in its cells
+VIEW_FIELDS = {
+    "group": ("group", ("teacher", "room")),
+    "teacher": ("teacher", ("group", "room")),
+    "room": ("room", ("group", "teacher"))
+}
+
+#   Decodes straight from the timeslot store. Meetings are pulled out of the group rows in one numpy pass,
+#   every id is named once through a lookup table, and the teacher and room views come from the same meetings.
+#   The store is read on every use, so a model that is still being stepped is decoded as it is now
+class MultiViewDecoder(IdDecoder):
+    def __init__(self, main_config, global_space: Space, timeslot_store: TimeslotStore, group_ids: list, teacher_ids: list, room_ids: list):
         self.main_config = main_config
         self.global_space = global_space
-        self.timeslots = timeslots
-    
-    def decode(self):
-        result = []
+        self.timeslot_store = timeslot_store
+        self.owner_ids = {"group": list(group_ids), "teacher": list(teacher_ids), "room": list(room_ids)}
+        self.group_rows = timeslot_store.rows_of(group_ids)
+        self.day_count = timeslot_store.class_codes.shape[1]
+        self.slot_count = timeslot_store.class_codes.shape[2]
+        self.frozen = None
+
+        self.names = {entity_id: global_space.get(entity_id) for entity_id in set(group_ids) | set(teacher_ids) | set(room_ids)}
+        self.names[FREE_CODE] = None
+
+        day_per_week = len(main_config["week_days"])
+        self.week_names = [main_config["week_parity"][day_i // day_per_week] for day_i in range(self.day_count)]
+        self.day_names = [main_config["week_days"][day_i % day_per_week] for day_i in range(self.day_count)]
+        self.slot_names = list(main_config["class_times"][:self.slot_count])
+
+#   (blocked group cells, meeting codes by field) as the store holds them now
+    def _read_store(self) -> tuple:
+        store = self.timeslot_store
+        class_codes = store.class_codes[self.group_rows]
+        group_indices, day_indices, slot_indices = np.nonzero(class_codes >= 0)
+        meeting_codes = {
+            "group": np.asarray(self.owner_ids["group"], dtype=np.int64)[group_indices],
+            "day": day_indices,
+            "slot": slot_indices,
+            "class": class_codes[group_indices, day_indices, slot_indices],
+            "teacher": store.teacher_codes[self.group_rows][group_indices, day_indices, slot_indices],
+            "room": store.room_codes[self.group_rows][group_indices, day_indices, slot_indices]
+        }
+
+        names = self.names
+        for field in ("class", "teacher", "room"):
+            for entity_id in np.unique(meeting_codes[field]).tolist():
+                if entity_id not in names: names[entity_id] = self.global_space.get(entity_id)
+        return class_codes == BLOCKED_CODE, meeting_codes
+
+    def _meetings(self) -> tuple:
+        return self.frozen if self.frozen is not None else self._read_store()
+
+#   A decoder pinned to the meetings the store holds now, for readers that outlive a lock on the model
+    def snapshot(self):
+        frozen = copy.copy(self)
+        frozen.frozen = self._read_store()
+        return frozen
+
+    def meeting_count(self) -> int:
+        return len(self._meetings()[1]["class"])
+
+#   Meeting indices sorted by the view's owner, then by day and slot. Ids are handed out
+#   in creation order, so sorting by id keeps owners in the order the configs list them
+    def _view_order(self, meeting_codes: dict, view: str, owner_id: int = None) -> np.ndarray:
+        owner_codes = meeting_codes[VIEW_FIELDS[view][0]]
+        order = np.lexsort((meeting_codes["slot"], meeting_codes["day"], owner_codes))
+        if owner_id is not None:
+            order = order[owner_codes[order] == owner_id]
+        return order
+
+#   Meetings come out one by one, only a chunk of them is turned into Python objects at a time
+    def iter_meetings(self, view: str = "group", owner_id: int = None, chunk_size: int = 4096):
+        if view not in VIEW_FIELDS:
+            raise Exception(f"Unknown timetable view {view}. Known views: {list(VIEW_FIELDS)}")
+
+        meeting_codes = self._meetings()[1]
+        names = self.names
         day_per_week = len(self.main_config["week_days"])
+        order = self._view_order(meeting_codes, view, owner_id)
+        for chunk_start in range(0, len(order), chunk_size):
+            chunk = order[chunk_start:chunk_start + chunk_size]
+            codes = {field: field_codes[chunk].tolist() for field, field_codes in meeting_codes.items()}
+            for meeting_i in range(len(chunk)):
+                day_i = codes["day"][meeting_i]
+                slot_i = codes["slot"][meeting_i]
+                yield {
+                    "week": self.week_names[day_i],
+                    "day": self.day_names[day_i],
+                    "time": self.slot_names[slot_i],
+                    "week_i": day_i // day_per_week,
+                    "day_i": day_i % day_per_week,
+                    "slot_i": slot_i,
+                    "group": names[codes["group"][meeting_i]],
+                    "class": names[codes["class"][meeting_i]],
+                    "teacher": names[codes["teacher"][meeting_i]],
+                    "room": names[codes["room"][meeting_i]],
+                    "group_id": codes["group"][meeting_i],
+                    "teacher_id": codes["teacher"][meeting_i],
+                    "room_id": codes["room"][meeting_i]
+                }
+
+    def _empty_timetable(self, view: str, owner_i: int, blocked_cells: np.ndarray) -> dict:
+        owner_field = VIEW_FIELDS[view][0]
+        timetable = {f"{owner_field}_name": self.names[self.owner_ids[view][owner_i]]}
+        blocked = blocked_cells[owner_i].tolist() if view == "group" else None
+        for day_i in range(self.day_count):
+            week_timetable = timetable.setdefault(self.week_names[day_i], {})
+            day_timetable = week_timetable.setdefault(self.day_names[day_i], {})
+            for slot_i, slot_name in enumerate(self.slot_names):
+#               Blocked group slots are left out of the timetable
+                if blocked is None or not blocked[day_i][slot_i]:
+                    day_timetable[slot_name] = "---"
+        return timetable
 
-        for group_id, group_timeslots in self.timeslots.items():
-            group_timetable = {}
-            group_timetable["group_name"] = self.global_space.get(group_id)
-
-            for week_i in range(len(self.main_config["week_parity"])):
-                week_name = self.main_config["week_parity"][week_i]
-                group_timetable[week_name] = {}
-
-                for day_i in range(week_i * day_per_week, (week_i * day_per_week) + day_per_week):
-                    #index = day_i - (day_per_week * week_i)
-                    day_name = self.main_config["week_days"][day_i - (day_per_week * week_i)]
-                    group_timetable[week_name][day_name] = {}
-
-                    for slot_i in range(len(group_timeslots[day_i])):
-                        slot_name = self.main_config["class_times"][slot_i]
-
-                        if isinstance(group_timeslots[day_i][slot_i], list):
-                            class_name = self.global_space.get(group_timeslots[day_i][slot_i][0])
-                            teacher_name = self.global_space.get(group_timeslots[day_i][slot_i][1])
-                            room_name = self.global_space.get(group_timeslots[day_i][slot_i][2])
-                            group_timetable[week_name][day_name][slot_name] = [class_name, teacher_name, room_name]
-                        elif isinstance(group_timeslots[day_i][slot_i], int): pass
-                        elif group_timeslots[day_i][slot_i] is None: 
-                            group_timetable[week_name][day_name][slot_name] = "---"
-
-            result.append(group_timetable)
-        return result
+#   The requested views in one pass over the meetings
+    def decode_views(self, view_names = tuple(VIEW_FIELDS)) -> dict:
+        for view in view_names:
+            if view not in VIEW_FIELDS:
+                raise Exception(f"Unknown timetable view {view}. Known views: {list(VIEW_FIELDS)}")
+
+        blocked_cells, meeting_codes = self._meetings()
+        views = {
+            view: [self._empty_timetable(view, owner_i, blocked_cells) for owner_i in range(len(self.owner_ids[view]))]
+            for view in view_names
+        }
+
+        names = self.names
+        week_names, day_names, slot_names = self.week_names, self.day_names, self.slot_names
+        codes = {field: field_codes.tolist() for field, field_codes in meeting_codes.items()}
+        for view in view_names:
+            owner_field, (first_field, second_field) = VIEW_FIELDS[view]
+            timetables = views[view]
+            view_index = {owner_id: owner_i for owner_i, owner_id in enumerate(self.owner_ids[view])}
+            for owner_code, day_i, slot_i, class_code, first_code, second_code in zip(
+                    codes[owner_field], codes["day"], codes["slot"], codes["class"], codes[first_field], codes[second_field]):
+                owner_i = view_index.get(owner_code)
+                if owner_i is None: continue
+                timetables[owner_i][week_names[day_i]][day_names[day_i]][slot_names[slot_i]] = [names[class_code], names[first_code], names[second_code]]
+        return views
+
+#   Group timetables only, the shape saved timetables, pages and jobs use
+    def decode(self):
+        return self.decode_views(("group",))["group"]
@@ -0,0 +1,167 @@
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from schedudle_model import ScheduleModel
+from entity_system import Space
+from solver_engine import SolverEngine, NegotiationEngine, StopReason
+from exact_solver import ExactEngine
+from schedule_decoder import MultiViewDecoder
+
+def make_timeslots(day_count, class_count):
+    timeslots = []
+    for i in range(day_count):
+        day = [None for _ in range(class_count)]
+        timeslots.append(day)
+    return timeslots
+
+def make_schedule_model(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict, global_space: Space, seed: int = 0, warm_start: list = None) -> ScheduleModel:
+    week_day_count = len(main_config["week_days"])
+    week_parity = len(main_config["week_parity"])
+    period_size = week_day_count * week_parity
+    empty_timeslots = {
+        "class_min_count": main_config["class_min_count"],
+        "timeslots": make_timeslots(period_size, main_config["class_max_count"])
+    }
+
+    model_config = {
+        "group_config": group_config,
+        "room_config": room_config,
+        "timepref_config": timepref_config,
+        "trace_config": main_config.get("trace", {}),
+        "profile_config": main_config.get("profile", {}),
+        "debug_config": main_config.get("debug", {}),
+        "solver_config": main_config.get("solver", {}),
+        "warm_start": warm_start
+    }
+    return ScheduleModel(empty_timeslots, week_parity, model_config, global_space, seed)
+
+def make_decoder(main_config: dict, schedule_model: ScheduleModel, global_space: Space) -> MultiViewDecoder:
+    return MultiViewDecoder(main_config, global_space, schedule_model.get_timeslot_store(),
+        schedule_model.group_ids, list(schedule_model.teacher_ids), schedule_model.room_ids)
+
+def make_engine(solver_config: dict, progress_callback = None) -> SolverEngine:
+    engine_name = solver_config.get("engine", NegotiationEngine.name)
+    negotiation_engine = NegotiationEngine(**solver_config.get("budget", {}), progress_callback=progress_callback)
+    if engine_name == NegotiationEngine.name:
+        return negotiation_engine
+    elif engine_name == ExactEngine.name:
+        return ExactEngine(**solver_config.get("exact", {}), negotiation_engine=negotiation_engine)
+    raise Exception(f"Unknown solver engine {engine_name}")
+
+def print_progress(progress: dict):
+    print(f"Step {progress['iterations']}, {progress['time']:.1f} s: {progress['resolved_percent']:.2f}% resolved, "
+          f"completed {progress['completed']}, failed {progress['failed']}")
+
+def build_schedule(schedule_model: ScheduleModel, verbose: bool = True, engine: SolverEngine = None, progress_callback = None) -> int:
+    if engine is None:
+        engine = make_engine(schedule_model.solver_config, progress_callback)
+    iterations = engine.solve(schedule_model)
+
+    if not verbose: return iterations
+
+    warm_start_stats = schedule_model.get_warm_start_stats()
+    if warm_start_stats is not None:
+        dropped = {outcome: count for outcome, count in warm_start_stats.items() if outcome not in ("meetings", "kept")}
+        print(f"Warm start: kept {warm_start_stats.get('kept', 0)} of {warm_start_stats['meetings']} meetings, dropped: {dropped}")
+
+    owned_class_count = schedule_model.owned_class_count()
+    failed_solution_count = schedule_model.failed_count()
+    completed_solution_count = schedule_model.completed_count()
+    completed_percent = f"{((completed_solution_count / owned_class_count) * 100):.2f}"
+    failed_percent = f"{((failed_solution_count / owned_class_count) * 100):.2f}"
+
+    print(f"Iteration count: {iterations}\n")
+    print(f"Owned class count: {owned_class_count}")
+    print(f"Completed solutions: {completed_percent}% ({completed_solution_count})")
+    print(f"Failed solutions: {failed_percent}% ({failed_solution_count})\n")
+
+    engine_stats = engine.get_stats()
+    if engine_stats is not None:
+        print(f"Engine {engine.name}: {engine_stats}\n")
+
+    repair_stats = schedule_model.get_repair_stats()
+    if repair_stats is not None:
+        print(f"Repaired classes: {repair_stats['repaired']} of {repair_stats['failed_before']}")
+        print(f"Group gaps: {repair_stats['gaps_before']} -> {repair_stats['gaps_after']}")
+        print(f"Repair moves: {repair_stats['moves_applied']} applied, {repair_stats['moves_evaluated']} evaluated "
+              f"in {repair_stats['steps']} steps, {repair_stats['time'] * 1000:.2f} ms\n")
+    return iterations
+
+def summarize_model(schedule_model: ScheduleModel, iterations: int) -> dict:
+    return {
+        "seed": schedule_model.seed,
+        "iterations": iterations,
+        "owned": schedule_model.owned_class_count(),
+        "completed": schedule_model.completed_count(),
+        "failed": schedule_model.failed_count(),
+        "preference_penalty": schedule_model.preference_penalty,
+        "stopped": schedule_model.stopped
+    }
+
+#   Runs in a worker process, so it builds its own space and only sends the summary back
+def solve_seed(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict, seed: int, warm_start: list = None) -> dict:
+    start_time = time.perf_counter()
+    schedule_model = make_schedule_model(main_config, group_config, room_config, timepref_config, Space(), seed, warm_start)
+    iterations = build_schedule(schedule_model, verbose=False)
+
+    summary = summarize_model(schedule_model, iterations)
+    summary["wall_time"] = time.perf_counter() - start_time
+    return summary
+
+def solve_seeds(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict, seeds: list, workers: int = None, warm_start: list = None) -> list:
+    if len(seeds) == 1 or workers == 1:
+        return [solve_seed(main_config, group_config, room_config, timepref_config, seed, warm_start) for seed in seeds]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(solve_seed, main_config, group_config, room_config, timepref_config, seed, warm_start)
+            for seed in seeds
+        ]
+        return [future.result() for future in futures]
+
+#   More completed classes wins, then the smaller preference penalty, then the smaller seed
+def best_result(results: list) -> dict:
+    if not results:
+        raise Exception("No seed results to choose from!")
+    return min(results, key=lambda result: (-result["completed"], result["preference_penalty"], result["seed"]))
+
+def seed_spread(results: list) -> dict:
+    completed = [result["completed"] for result in results]
+    penalties = [result["preference_penalty"] for result in results]
+    return {
+        "seeds": len(results),
+        "completed_min": min(completed),
+        "completed_max": max(completed),
+        "completed_mean": statistics.fmean(completed),
+        "completed_stdev": statistics.pstdev(completed),
+        "penalty_min": min(penalties),
+        "penalty_max": max(penalties)
+    }
+
+def print_seed_report(results: list, best: dict):
+    for result in sorted(results, key=lambda result: result["seed"]):
+        marker = "*" if result is best else " "
+        print(f"{marker} seed {result['seed']:>5}  completed: {result['completed']}/{result['owned']}  "
+              f"penalty: {result['preference_penalty']:.2f}  iterations: {result['iterations']}  "
+              f"time: {result['wall_time'] * 1000:.2f} ms")
+
+    spread = seed_spread(results)
+    print(f"Completed over {spread['seeds']} seeds: min {spread['completed_min']}, max {spread['completed_max']}, "
+          f"mean {spread['completed_mean']:.2f}, stdev {spread['completed_stdev']:.2f}")
+    print(f"Preference penalty: min {spread['penalty_min']:.2f}, max {spread['penalty_max']:.2f}\n")
+
+def solve_best_of(main_config: dict, group_config: dict, room_config: dict, timepref_config: dict, global_space: Space, seeds: list, workers: int = None, verbose: bool = True, warm_start: list = None) -> ScheduleModel:
+    results = solve_seeds(main_config, group_config, room_config, timepref_config, seeds, workers, warm_start)
+    best = best_result(results)
+    if verbose: print_seed_report(results, best)
+
+#   Only the seed comes back from the pool, the winning schedule is rebuilt from it here
+    schedule_model = make_schedule_model(main_config, group_config, room_config, timepref_config, global_space, best["seed"], warm_start)
+    iterations = build_schedule(schedule_model, verbose)
+    rebuilt = summarize_model(schedule_model, iterations)
+#   A run cut by the clock depends on the machine's load, only step-bounded runs have to reproduce
+    timed_out = StopReason.TIME_LIMIT.name in (best["stopped"], rebuilt["stopped"])
+    if not timed_out and rebuilt != {key: best[key] for key in rebuilt}:
+        raise Exception(f"Seed {best['seed']} did not reproduce its result. Expected {best}, got {rebuilt}")
+    return schedule_model
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from entity_system import Space
+from schedule_runner import make_schedule_model, make_engine, make_decoder, build_schedule, summarize_model
+
+CONFIG_NAMES = ("main_config", "group_config", "room_config", "timepref_config")
+
+class JobStatus(Enum):
+    QUEUED = 0,
+    RUNNING = 1,
+    DONE = 2,
+    FAILED = 3
+
+def config_hash(configs: dict, seed: int) -> str:
+    payload = json.dumps({"configs": configs, "seed": seed}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+#   Worker side. Progress goes back over a queue handed to every worker once, when the pool starts
+progress_queue = None
+
+def _init_worker(queue):
+    global progress_queue
+    progress_queue = queue
+
+def run_job(job_id: str, configs: dict, seed: int) -> dict:
+    start_time = time.perf_counter()
+    main_config = configs["main_config"]
+    global_space = Space()
+    schedule_model = make_schedule_model(main_config, configs["group_config"], configs["room_config"], configs["timepref_config"], global_space, seed)
+
+    progress_queue.put((job_id, JobStatus.RUNNING.name, schedule_model.get_progress()))
+    engine = make_engine(schedule_model.solver_config, lambda progress: progress_queue.put((job_id, JobStatus.RUNNING.name, progress)))
+    iterations = build_schedule(schedule_model, verbose=False, engine=engine)
+
+    summary = summarize_model(schedule_model, iterations)
+    summary["wall_time"] = time.perf_counter() - start_time
+    return {
+        "summary": summary,
+        "engine_stats": engine.get_stats(),
+        "repair_stats": schedule_model.get_repair_stats(),
+        "timetables": make_decoder(main_config, schedule_model, global_space).decode()
+    }
+
+class SolveJob:
+    def __init__(self, job_id: str, config_key: str, seed: int):
+        self.id = job_id
+        self.config_key = config_key
+        self.seed = seed
+        self.status = JobStatus.QUEUED
+        self.progress = None
+        self.summary = None
+        self.error = None
+        self.cached = False
+        self.version = 0
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status.name,
+            "seed": self.seed,
+            "config_hash": self.config_key,
+            "cached": self.cached,
+            "progress": self.progress,
+            "summary": self.summary,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at
+        }
+
+#   Jobs run in a process pool, so solving never holds the web server's threads or its GIL.
+#   A listener thread moves worker progress onto the jobs, version bumps wake up event streams.
+#   Results live only in the LRU cache, a job keeps its summary and finds its result by config key
+class JobManager:
+    def __init__(self, workers: int = None, cache_size: int = 32, max_jobs: int = 256):
+        self.context = multiprocessing.get_context("spawn")
+        self.progress_queue = self.context.Queue()
+        self.executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=self.context,
+            initializer=_init_worker, initargs=(self.progress_queue,))
+        self.jobs = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.max_jobs = max_jobs
+        self.changed = threading.Condition()
+        self.listener = threading.Thread(target=self._listen, daemon=True)
+        self.listener.start()
+
+    def _listen(self):
+        while True:
+            message = self.progress_queue.get()
+            if message is None: return
+            job_id, status_name, progress = message
+            with self.changed:
+                job = self.jobs.get(job_id)
+                if job is None or job.status in (JobStatus.DONE, JobStatus.FAILED): continue
+                job.status = JobStatus[status_name]
+                job.progress = progress
+                job.version += 1
+                self.changed.notify_all()
+
+    def _finish(self, job: SolveJob, future):
+        with self.changed:
+            try:
+                result = future.result()
+                job.summary = result["summary"]
+                job.progress = job.summary
+                job.status = JobStatus.DONE
+                self.cache[job.config_key] = result
+                self.cache.move_to_end(job.config_key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            except Exception as exception:
+                job.error = f"{type(exception).__name__}: {exception}"
+                job.status = JobStatus.FAILED
+            job.finished_at = time.time()
+            job.version += 1
+            self._evict_jobs()
+            self.changed.notify_all()
+
+#   The oldest finished jobs are forgotten first, queued and running ones are always kept
+    def _evict_jobs(self):
+        finished_ids = [job_id for job_id, job in self.jobs.items() if job.status in (JobStatus.DONE, JobStatus.FAILED)]
+        for job_id in finished_ids[:max(len(self.jobs) - self.max_jobs, 0)]:
+            del self.jobs[job_id]
+
+    def submit(self, configs: dict, seed: int = 0) -> SolveJob:
+        missing = [config_name for config_name in CONFIG_NAMES if config_name not in configs]
+        if missing:
+            raise Exception(f"Job configs are missing {missing}")
+
+        config_key = config_hash({config_name: configs[config_name] for config_name in CONFIG_NAMES}, seed)
+        job = SolveJob(uuid.uuid4().hex, config_key, seed)
+        with self.changed:
+            self.jobs[job.id] = job
+            self._evict_jobs()
+            if config_key in self.cache:
+                self.cache.move_to_end(config_key)
+                job.summary = self.cache[config_key]["summary"]
+                job.progress = job.summary
+                job.status = JobStatus.DONE
+                job.cached = True
+                job.finished_at = time.time()
+                return job
+
+        future = self.executor.submit(run_job, job.id, configs, seed)
+        future.add_done_callback(lambda future: self._finish(job, future))
+        return job
+
+    def get(self, job_id: str) -> SolveJob:
+        with self.changed:
+            return self.jobs.get(job_id)
+
+#   None once the result has been pushed out of the cache
+    def get_result(self, job: SolveJob) -> dict:
+        with self.changed:
+            result = self.cache.get(job.config_key)
+            if result is not None: self.cache.move_to_end(job.config_key)
+            return result
+
+    def list_jobs(self) -> list:
+        with self.changed:
+            return [job.to_dict() for job in self.jobs.values()]
+
+#   Blocks until the job changes past the version the caller has seen, or the timeout runs out
+    def wait_for_change(self, job: SolveJob, seen_version: int, timeout: float) -> tuple:
+        with self.changed:
+            self.changed.wait_for(lambda: job.version != seen_version, timeout)
+            return job.version, job.to_dict()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.progress_queue.put(None)
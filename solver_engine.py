@@ -0,0 +1,78 @@
+import time
+from abc import abstractmethod
+from enum import Enum
+
+class StopReason(Enum):
+    TIME_LIMIT = 0,
+    STEP_LIMIT = 1
+
+class SolverEngine:
+    name = None
+
+    @abstractmethod
+    def solve(self, schedule_model) -> int: pass
+
+    def get_stats(self) -> dict:
+        return None
+
+#   The agents negotiate step by step until every teacher (and the deanery, if any) is done.
+#   With a time or step limit the loop stops early, the model then drops whatever is still being negotiated
+class NegotiationEngine(SolverEngine):
+    name = "negotiation"
+
+    def __init__(self, time_limit: float = None, step_limit: int = None, progress_callback = None, progress_interval: float = 1.0):
+        self.time_limit = time_limit
+        self.step_limit = step_limit
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.stats = None
+
+    def _report_progress(self, schedule_model, iterations: int, elapsed: float):
+        progress = schedule_model.get_progress()
+        progress["iterations"] = iterations
+        progress["time"] = elapsed
+        self.progress_callback(progress)
+
+#   start_time lets an engine that ran before this one share the same deadline
+    def solve(self, schedule_model, start_time: float = None) -> int:
+        if start_time is None: start_time = time.perf_counter()
+        deadline = start_time + self.time_limit if self.time_limit is not None else None
+        next_report = time.perf_counter() + self.progress_interval
+
+        iterations = 0
+        stop_reason = None
+        while not schedule_model.schedule_ready():
+            if self.step_limit is not None and iterations >= self.step_limit:
+                stop_reason = StopReason.STEP_LIMIT
+                break
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                stop_reason = StopReason.TIME_LIMIT
+                break
+            if self.progress_callback is not None and now >= next_report:
+                self._report_progress(schedule_model, iterations, now - start_time)
+                next_report = now + self.progress_interval
+
+            schedule_model.step()
+            iterations += 1
+
+        unresolved_count = 0
+        if stop_reason is not None:
+            unresolved_count = schedule_model.stop_negotiation(stop_reason.name)
+            schedule_model.trace.warning("Solving stopped by {} after {} steps, {} classes left unresolved",
+                stop_reason.name, iterations, unresolved_count)
+
+        elapsed = time.perf_counter() - start_time
+        if self.progress_callback is not None:
+            self._report_progress(schedule_model, iterations, elapsed)
+
+        self.stats = {
+            "steps": iterations,
+            "time": elapsed,
+            "stopped": stop_reason.name if stop_reason is not None else None,
+            "unresolved": unresolved_count
+        }
+        return iterations
+
+    def get_stats(self) -> dict:
+        return self.stats
@@ -0,0 +1,84 @@
+import time
+
+#   Counters of where a run spends its time: teacher steps by state, message handlers by receiver
+#   and message type, and sends by message type. A disabled profile costs one flag test per call site.
+class SolverProfile:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.state_counters = {}
+        self.handler_counters = {}
+        self.sent_counters = {}
+        self.rejected_count = 0
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+
+    def begin(self) -> tuple:
+        return time.perf_counter(), self.rejected_count
+
+#   Counters are [calls, seconds, rejections]. Times are inclusive, a state's time covers the handlers
+#   of the requests it made, and its rejections are the REJECT replies sent while it ran
+    def _add(self, counters: dict, key, mark: tuple):
+        counter = counters.get(key)
+        if counter is None:
+            counter = counters[key] = [0, 0.0, 0]
+        counter[0] += 1
+        counter[1] += time.perf_counter() - mark[0]
+        counter[2] += self.rejected_count - mark[1]
+
+    def end_state(self, state, mark: tuple):
+        self._add(self.state_counters, state.name, mark)
+
+    def end_handler(self, agent_name: str, message_type, mark: tuple):
+        self._add(self.handler_counters, (agent_name, message_type.name), mark)
+
+    def end_send(self, message_type, mark: tuple, rejected: bool):
+        if rejected: self.rejected_count += 1
+        self._add(self.sent_counters, message_type.name, mark)
+
+    def to_dict(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "states": {
+                state_name: {"calls": calls, "time": seconds, "rejections": rejections}
+                for state_name, (calls, seconds, rejections) in self.state_counters.items()
+            },
+            "handlers": [
+                {"agent": agent_name, "message": message_name, "calls": calls, "time": seconds, "rejections": rejections}
+                for (agent_name, message_name), (calls, seconds, rejections) in self.handler_counters.items()
+            ],
+            "sent": {
+                message_name: {"calls": calls, "time": seconds}
+                for message_name, (calls, seconds, _) in self.sent_counters.items()
+            },
+            "rejections": self.rejected_count
+        }
+
+def _prometheus_metric(lines: list, name: str, kind: str, help_text: str, samples: list):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+def to_prometheus(profile: SolverProfile, model_stats: dict, prefix: str = "scheduler") -> str:
+    lines = []
+    for stat_name, value in model_stats.items():
+        _prometheus_metric(lines, f"{prefix}_{stat_name}", "gauge", f"Model {stat_name.replace('_', ' ')}", [((), value)])
+
+    counter_kinds = (("calls_total", 0, "calls"), ("seconds_total", 1, "cumulative time"), ("rejections_total", 2, "REJECT replies"))
+    for suffix, field_i, description in counter_kinds:
+        _prometheus_metric(lines, f"{prefix}_state_{suffix}", "counter", f"Teacher step {description} by state",
+            [((("state", state_name),), counter[field_i]) for state_name, counter in profile.state_counters.items()])
+    for suffix, field_i, description in counter_kinds:
+        _prometheus_metric(lines, f"{prefix}_handler_{suffix}", "counter", f"Message handler {description} by agent and message type",
+            [((("agent", agent_name), ("message", message_name)), counter[field_i])
+             for (agent_name, message_name), counter in profile.handler_counters.items()])
+    for suffix, field_i, description in counter_kinds[:2]:
+        _prometheus_metric(lines, f"{prefix}_sent_{suffix}", "counter", f"send_message {description} by message type",
+            [((("message", message_name),), counter[field_i]) for message_name, counter in profile.sent_counters.items()])
+    _prometheus_metric(lines, f"{prefix}_profile_enabled", "gauge", "Whether the profiling counters are collected", [((), int(profile.enabled))])
+    return "\n".join(lines) + "\n"
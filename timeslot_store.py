@@ -0,0 +1,128 @@
+from collections import deque
+import numpy as np
+
+FREE_CODE = -1
+BLOCKED_CODE = -2
+
+class TimeslotView:
+    __slots__ = ("entity_id", "store", "row", "class_codes", "teacher_codes", "room_codes")
+
+    def __init__(self, store, row: int, entity_id: int):
+        self.entity_id = entity_id
+        self.store = store
+        self.row = row
+        self.class_codes = store.class_codes[row]
+        self.teacher_codes = store.teacher_codes[row]
+        self.room_codes = store.room_codes[row]
+
+    def day_count(self) -> int:
+        return self.class_codes.shape[0]
+
+    def slot_count(self) -> int:
+        return self.class_codes.shape[1]
+
+    def is_free(self, day_i: int, slot_i: int) -> bool:
+        return self.class_codes[day_i, slot_i] == FREE_CODE
+
+    def is_meeting(self, day_i: int, slot_i: int) -> bool:
+        return self.class_codes[day_i, slot_i] >= 0
+
+    def get_meeting(self, day_i: int, slot_i: int) -> tuple:
+        room_id = int(self.room_codes[day_i, slot_i])
+        return (int(self.class_codes[day_i, slot_i]), int(self.teacher_codes[day_i, slot_i]), None if room_id == FREE_CODE else room_id)
+
+    def set_meeting(self, day_i: int, slot_i: int, class_id: int, teacher_id: int, room_id: int = None):
+        self.class_codes[day_i, slot_i] = class_id
+        self.teacher_codes[day_i, slot_i] = teacher_id
+        self.room_codes[day_i, slot_i] = FREE_CODE if room_id is None else room_id
+        if self.store.journal is not None: self.store.record(self.row, day_i, slot_i)
+
+    def set_room(self, day_i: int, slot_i: int, room_id: int):
+        self.room_codes[day_i, slot_i] = room_id
+        if self.store.journal is not None: self.store.record(self.row, day_i, slot_i)
+
+    def block(self, day_i: int, slot_i: int):
+        self.class_codes[day_i, slot_i] = BLOCKED_CODE
+        self.teacher_codes[day_i, slot_i] = FREE_CODE
+        self.room_codes[day_i, slot_i] = FREE_CODE
+        if self.store.journal is not None: self.store.record(self.row, day_i, slot_i)
+
+    def clear(self, day_i: int, slot_i: int):
+        self.class_codes[day_i, slot_i] = FREE_CODE
+        self.teacher_codes[day_i, slot_i] = FREE_CODE
+        self.room_codes[day_i, slot_i] = FREE_CODE
+        if self.store.journal is not None: self.store.record(self.row, day_i, slot_i)
+
+    def free_flags(self) -> np.ndarray:
+        return self.class_codes == FREE_CODE
+
+    def meeting_count(self) -> int:
+        return int(np.count_nonzero(self.class_codes >= 0))
+
+#   The grids below keep the list-of-lists shape the decoder and pages were written against
+    def to_group_grid(self, blocked_id: int) -> list:
+        grid = []
+        for class_row, teacher_row, room_row in zip(self.class_codes.tolist(), self.teacher_codes.tolist(), self.room_codes.tolist()):
+            day = []
+            for class_id, teacher_id, room_id in zip(class_row, teacher_row, room_row):
+                if class_id == FREE_CODE: day.append(None)
+                elif class_id == BLOCKED_CODE: day.append(blocked_id)
+                else: day.append([class_id, teacher_id, None if room_id == FREE_CODE else room_id])
+            grid.append(day)
+        return grid
+
+    def to_room_grid(self) -> list:
+        return [[None if class_id < 0 else class_id for class_id in class_row] for class_row in self.class_codes.tolist()]
+
+class TimeslotStore:
+    def __init__(self, entity_ids: list, day_count: int, slot_count: int, journal_capacity: int = 0):
+        self.rows = {entity_id: row for row, entity_id in enumerate(entity_ids)}
+        if len(self.rows) != len(entity_ids):
+            raise Exception("Timeslot store entity ids must be unique!")
+        self.entity_ids = list(entity_ids)
+
+#       Change journal of (step, row, day, slot) for delta updates. Once it wraps around,
+#       changes up to journal_floor are lost and older steps can only be answered with a full reload
+        self.journal = deque(maxlen=journal_capacity) if journal_capacity > 0 else None
+        self.journal_floor = 0
+        self.step = 0
+
+        shape = (len(entity_ids), day_count, slot_count)
+        self.class_codes = np.full(shape, FREE_CODE, dtype=np.int32)
+        self.teacher_codes = np.full(shape, FREE_CODE, dtype=np.int32)
+        self.room_codes = np.full(shape, FREE_CODE, dtype=np.int32)
+
+    def view(self, entity_id: int) -> TimeslotView:
+        return TimeslotView(self, self.rows[entity_id], entity_id)
+
+    def row_of(self, entity_id: int) -> int:
+        return self.rows[entity_id]
+
+    def rows_of(self, entity_ids) -> np.ndarray:
+        return np.fromiter((self.rows[entity_id] for entity_id in entity_ids), dtype=np.intp)
+
+    def meeting_count(self, entity_ids) -> int:
+        return int(np.count_nonzero(self.class_codes[self.rows_of(entity_ids)] >= 0))
+
+    def record(self, row: int, day_i: int, slot_i: int):
+        journal = self.journal
+        if len(journal) == journal.maxlen:
+            self.journal_floor = journal[0][0]
+        journal.append((self.step, row, day_i, slot_i))
+
+#   Cells changed after since_step, each once, or None when the journal no longer reaches that far back
+    def changes_since(self, since_step: int) -> list:
+        if self.journal is None or since_step < self.journal_floor: return None
+
+        changed = {}
+        for step, row, day_i, slot_i in reversed(self.journal):
+            if step <= since_step: break
+            changed[(row, day_i, slot_i)] = None
+        return [
+            (self.entity_ids[row], day_i, slot_i,
+             int(self.class_codes[row, day_i, slot_i]), int(self.teacher_codes[row, day_i, slot_i]), int(self.room_codes[row, day_i, slot_i]))
+            for row, day_i, slot_i in sorted(changed)
+        ]
+
+    def nbytes(self) -> int:
+        return self.class_codes.nbytes + self.teacher_codes.nbytes + self.room_codes.nbytes
@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+import re
+from datetime import date, datetime, timedelta, timezone
+from schedule_decoder import MultiViewDecoder
+
+EXPORT_FORMATS = ("jsonl", "csv", "ics")
+CSV_FIELDS = ("week", "day", "time", "group", "class", "teacher", "room")
+TIME_RANGE = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$")
+
+#   Every exporter is a generator of text chunks, so a file or an HTTP response can be written
+#   while the decoder is still walking the meetings
+
+def iter_jsonl(decoder: MultiViewDecoder, view: str = "group", owner_id: int = None):
+    for meeting in decoder.iter_meetings(view, owner_id):
+        yield json.dumps({field: meeting[field] for field in CSV_FIELDS}, ensure_ascii=False) + "\n"
+
+def iter_csv(decoder: MultiViewDecoder, view: str = "group", owner_id: int = None, chunk_rows: int = 1024):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for row_i, meeting in enumerate(decoder.iter_meetings(view, owner_id), 1):
+        writer.writerow([meeting[field] for field in CSV_FIELDS])
+        if row_i % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _ics_text(text: str) -> str:
+    return str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+#   Content lines longer than 75 octets are folded onto continuation lines starting with a space
+def _ics_line(line: str) -> str:
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75: return line + "\r\n"
+
+    parts = []
+    start = 0
+    limit = 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+#       Never cut a UTF-8 sequence in half
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode("utf-8"))
+        start = end
+        limit = 74
+    return "\r\n ".join(parts) + "\r\n"
+
+def _slot_times(slot_names: list) -> list:
+    slot_times = []
+    for slot_name in slot_names:
+        match = TIME_RANGE.match(slot_name)
+        if match is None:
+            raise Exception(f"Class time {slot_name} is not a HH:MM-HH:MM range, it can't be put on a calendar")
+        start_hour, start_minute, end_hour, end_minute = (int(part) for part in match.groups())
+        slot_times.append(((start_hour, start_minute), (end_hour, end_minute)))
+    return slot_times
+
+#   Every meeting becomes a weekly event repeating once per parity cycle over the term. term_start
+#   is the Monday of the first week, times are local to the university (floating, no time zone)
+def iter_ics(decoder: MultiViewDecoder, view: str = "group", owner_id: int = None, term_start: date = None, term_weeks: int = 16):
+    if term_start is None:
+        today = date.today()
+        term_start = today - timedelta(days=today.weekday())
+#   Checked before the first chunk, so a bad config fails the request instead of cutting the stream short
+    slot_times = _slot_times(decoder.slot_names)
+    return _iter_ics_events(decoder, view, owner_id, term_start, term_weeks, slot_times)
+
+def _iter_ics_events(decoder: MultiViewDecoder, view: str, owner_id: int, term_start: date, term_weeks: int, slot_times: list):
+    week_count = len(decoder.main_config["week_parity"])
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    yield _ics_line("BEGIN:VCALENDAR")
+    yield _ics_line("VERSION:2.0")
+    yield _ics_line("PRODID:-//Uni-scheduler//Timetable export//RU")
+    yield _ics_line("CALSCALE:GREGORIAN")
+    for meeting in decoder.iter_meetings(view, owner_id):
+        occurrences = len(range(meeting["week_i"], term_weeks, week_count))
+        if not occurrences: continue
+
+        meeting_date = term_start + timedelta(days=meeting["week_i"] * 7 + meeting["day_i"])
+        (start_hour, start_minute), (end_hour, end_minute) = slot_times[meeting["slot_i"]]
+        starts_at = datetime(meeting_date.year, meeting_date.month, meeting_date.day, start_hour, start_minute)
+        ends_at = datetime(meeting_date.year, meeting_date.month, meeting_date.day, end_hour, end_minute)
+
+        yield _ics_line("BEGIN:VEVENT")
+        yield _ics_line(f"UID:{meeting['group_id']}-{meeting['week_i']}-{meeting['day_i']}-{meeting['slot_i']}@uni-scheduler")
+        yield _ics_line(f"DTSTAMP:{stamp}")
+        yield _ics_line(f"DTSTART:{starts_at.strftime('%Y%m%dT%H%M%S')}")
+        yield _ics_line(f"DTEND:{ends_at.strftime('%Y%m%dT%H%M%S')}")
+        yield _ics_line(f"RRULE:FREQ=WEEKLY;INTERVAL={week_count};COUNT={occurrences}")
+        yield _ics_line(f"SUMMARY:{_ics_text(meeting['class'])}")
+        yield _ics_line(f"LOCATION:{_ics_text(meeting['room'])}")
+        yield _ics_line(f"DESCRIPTION:{_ics_text(meeting['group'])}\\n{_ics_text(meeting['teacher'])}")
+        yield _ics_line("END:VEVENT")
+    yield _ics_line("END:VCALENDAR")
+
+def iter_export(decoder: MultiViewDecoder, export_format: str, view: str = "group", owner_id: int = None, **options):
+    if export_format == "jsonl": return iter_jsonl(decoder, view, owner_id)
+    elif export_format == "csv": return iter_csv(decoder, view, owner_id)
+    elif export_format == "ics": return iter_ics(decoder, view, owner_id, **options)
+    raise Exception(f"Unknown export format {export_format}. Known formats: {list(EXPORT_FORMATS)}")
+
+def write_export(path: str, chunks):
+#   iCalendar lines already end in CRLF, so newlines are written as they are
+    with open(path, "w", encoding="utf-8", newline="") as output_file:
+        for chunk in chunks:
+            output_file.write(chunk)
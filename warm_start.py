@@ -0,0 +1,29 @@
+import json
+
+#   Reads back what save_timetable wrote: one dict per group, keyed by week, day and class time names
+def load_timetable(timetable_path: str) -> list:
+    with open(timetable_path, encoding="utf-8") as timetable_file:
+        return json.load(timetable_file)
+
+def timetable_meetings(main_config: dict, timetable: list) -> list:
+    day_per_week = len(main_config["week_days"])
+    day_index = {day_name: day_i for day_i, day_name in enumerate(main_config["week_days"])}
+    slot_index = {slot_name: slot_i for slot_i, slot_name in enumerate(main_config["class_times"])}
+
+    meetings = []
+    for group_timetable in timetable:
+        for week_i, week_name in enumerate(main_config["week_parity"]):
+            for day_name, day in group_timetable.get(week_name, {}).items():
+                for slot_name, slot in day.items():
+                    if not isinstance(slot, list): continue
+                    if day_name not in day_index or slot_name not in slot_index: continue
+
+                    meetings.append({
+                        "group": group_timetable["group_name"],
+                        "class": slot[0],
+                        "teacher": slot[1],
+                        "room": slot[2],
+                        "day": week_i * day_per_week + day_index[day_name],
+                        "slot": slot_index[slot_name]
+                    })
+    return meetings